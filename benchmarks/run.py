@@ -0,0 +1,255 @@
+"""
+Benchmark the webhook handler against stub GitHub and SMTP servers.
+
+The recorded payloads are replayed against the app, along with synthetic events derived from them,
+for each combination of the numbers of watched repositories, patterns per repository and files
+changed per pull request. The p50 and p99 latencies and the throughput of each combination are reported.
+
+    python -m benchmarks.run --repos 10,1000 --patterns 1,20 --files 10,300 --requests 500
+"""
+import argparse
+import copy
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+from pr_watcher_notifier import create_app
+
+from .stubs import StubGitHub, StubSMTP
+
+# The webhook secret of the benchmarked app, which only signs the local requests.
+WEBHOOK_KEY = 'benchmark'
+DEFAULT_PAYLOAD = Path(__file__).parent.parent / 'test_data' / 'pr_145_merged.json'
+# The actions of the events sent, in turn: the ignored ones are rejected before the JSON is parsed.
+ACTIONS = ('opened', 'synchronize', 'closed', 'labeled')
+
+
+def make_watch_config(repos, patterns):
+    """
+    Return a watch configuration with `repos` watched repositories, of which one in ten is an organization wildcard.
+    """
+    watched_patterns = [f'docs/area{i}/*.rst' for i in range(patterns - 1)] + ['docs/decisions/*.rst']
+    watch_config = {}
+    for i in range(repos):
+        key = f'org{i}/*' if i % 10 == 9 else f'org{i // 10}/repo{i}'
+        watch_config[key] = {
+            'patterns': watched_patterns,
+            'recipients': [f'watchers{i}@example.com'],
+            'subject': 'Change in {{ repo }}: {{ pr.title }}',
+        }
+    return watch_config
+
+
+def get_repo_names(watch_config):
+    """
+    Return a repository name matching each key of the watch configuration.
+    """
+    return [key.replace('*', 'wildcard-repo') for key in watch_config]
+
+
+def make_payloads(templates, repo_names, count, base_url, seed=0):
+    """
+    Make the signed request bodies of `count` events, from the recorded payloads.
+
+    Every event has a new head commit, so that the responses cached for the previous events aren't used.
+    """
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        data = copy.deepcopy(templates[i % len(templates)])
+        data['action'] = ACTIONS[i % len(ACTIONS)]
+        repo = rng.choice(repo_names)
+        data['repository']['full_name'] = repo
+        data['repository']['private'] = False
+        data['number'] = data['pull_request']['number'] = 1 + i % 50
+        data['pull_request']['url'] = f'{base_url}/repos/{repo}/pulls/{data["number"]}'
+        data['pull_request']['head']['sha'] = hashlib.sha1(f'head-{i}'.encode()).hexdigest()
+        data['pull_request']['updated_at'] = f'2024-01-01T00:00:{i % 60:02d}Z'
+        data['before'] = hashlib.sha1(f'before-{i}'.encode()).hexdigest()
+        data['after'] = data['pull_request']['head']['sha']
+        # GitHub sends the action first, which lets the ignored actions be rejected early.
+        body = json.dumps({'action': data.pop('action'), **data}).encode('utf-8')
+        signature = 'sha256=' + hmac.new(WEBHOOK_KEY.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        payloads.append((body, signature))
+    return payloads
+
+
+class BenchmarkSettings:  # pylint: disable=too-few-public-methods
+    """
+    The settings of the benchmarked app, completed for each run.
+    """
+    GITHUB_WEBHOOK_SECRET = WEBHOOK_KEY
+    GITHUB_ACCESS_TOKEN = 'benchmark'
+    GITHUB_RETRIES = 0
+    # Measure the app rather than the PyGithub throttling, which can be restored with `--setting`.
+    GITHUB_SECONDS_BETWEEN_REQUESTS = 0
+    MAIL_DEFAULT_SENDER = 'benchmark@example.com'
+    MAIL_SERVER = '127.0.0.1'
+    MAIL_USE_TLS = False
+
+
+def make_app(watch_config, github, smtp, overrides):
+    """
+    Create the benchmarked app, talking to the stub servers.
+    """
+    settings = type('Settings', (BenchmarkSettings,), {
+        'WATCH_CONFIG': watch_config,
+        'GITHUB_BASE_URL': github.url,
+        'MAIL_PORT': smtp.port,
+        **overrides,
+    })
+    app = create_app(settings)
+    app.logger.setLevel(logging.WARNING)
+    return app
+
+
+def run(app, payloads, concurrency):
+    """
+    Send the payloads to the app from `concurrency` threads, returning the latencies and the elapsed time.
+    """
+    local = threading.local()
+
+    def send(payload):
+        body, signature = payload
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = local.client.post(
+            '/pull-requests',
+            data=body,
+            content_type='application/json',
+            headers={'X-Github-Event': 'pull_request', 'X-Hub-Signature-256': signature},
+        )
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f'Unexpected response: {response.status_code}')
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, payloads))
+    return latencies, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """
+    Return the given percentile of the values.
+    """
+    return statistics.quantiles(values, n=100, method='inclusive')[round(fraction * 100) - 1]
+
+
+def parse_counts(value):
+    """
+    Parse a comma-separated list of counts.
+    """
+    return [int(count) for count in value.split(',')]
+
+
+def parse_setting(value):
+    """
+    Parse a `NAME=VALUE` app setting, the value being YAML.
+    """
+    name, _, setting = value.partition('=')
+    return name, yaml.safe_load(setting)
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--repos', type=parse_counts, default=[10, 1000], help='numbers of watched repositories')
+    parser.add_argument('--patterns', type=parse_counts, default=[1, 20], help='numbers of patterns per repository')
+    parser.add_argument('--files', type=parse_counts, default=[10, 300], help='numbers of files changed per PR')
+    parser.add_argument('--requests', type=int, default=200, help='number of webhooks sent per configuration')
+    parser.add_argument('--warmup', type=int, default=20, help='number of webhooks sent before measuring')
+    parser.add_argument('--concurrency', type=int, default=1, help='number of concurrent senders')
+    parser.add_argument('--github-latency', type=float, default=0.0, help='milliseconds added to each GitHub call')
+    parser.add_argument('--payload', type=Path, action='append', help='recorded webhook payload, may be repeated')
+    parser.add_argument('--setting', type=parse_setting, action='append', default=[], help='app setting NAME=VALUE')
+    parser.add_argument('--json', type=Path, help='also write the results to this JSON file')
+    return parser.parse_args(argv)
+
+
+def count_calls(github, smtp):
+    """
+    Return the numbers of GitHub calls, of GitHub calls answered with a 304, and of emails so far.
+    """
+    return sum(github.calls.values()), github.not_modified, smtp.messages
+
+
+def prepare(args, templates, github, smtp, counts):
+    """
+    Create the app and the payloads for a combination of the numbers of watched repositories, patterns and files.
+    """
+    repos, patterns, files = counts
+    watch_config = make_watch_config(repos, patterns)
+    github.files = files
+    app = make_app(watch_config, github, smtp, dict(args.setting))
+    payloads = make_payloads(
+        templates, get_repo_names(watch_config), args.warmup + args.requests, github.url, seed=repos
+    )
+    return app, payloads
+
+
+def benchmark(args, templates, github, smtp, counts):
+    """
+    Benchmark a combination of the numbers of watched repositories, patterns and files, and return its results.
+
+    The GitHub calls answered with a 304 are part of the calls, and are also reported on their own.
+    """
+    app, payloads = prepare(args, templates, github, smtp, counts)
+    run(app, payloads[:args.warmup], args.concurrency)
+    before = count_calls(github, smtp)
+    latencies, elapsed = run(app, payloads[args.warmup:], args.concurrency)
+    calls, not_modified, emails = (after - count for after, count in zip(count_calls(github, smtp), before))
+    return {
+        **dict(zip(('repos', 'patterns', 'files'), counts)),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput': len(latencies) / elapsed,
+        'github_calls_per_request': calls / len(latencies),
+        'not_modified_per_request': not_modified / len(latencies),
+        'emails': emails,
+    }
+
+
+def main(argv=None):
+    """
+    Run the benchmarks and print a line of results per configuration.
+    """
+    args = parse_args(argv)
+    templates = []
+    for path in args.payload or [DEFAULT_PAYLOAD]:
+        with open(path, encoding='utf-8') as payload_file:
+            templates.append(json.load(payload_file))
+    github = StubGitHub(latency=args.github_latency / 1000)
+    smtp = StubSMTP()
+    results = []
+    print(f'{"repos":>6} {"patterns":>8} {"files":>6} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8} '
+          f'{"GitHub calls/req":>16} {"304s/req":>8} {"emails":>6}')
+    for counts in itertools.product(args.repos, args.patterns, args.files):
+        result = benchmark(args, templates, github, smtp, counts)
+        results.append(result)
+        print(f'{result["repos"]:>6} {result["patterns"]:>8} {result["files"]:>6} {result["p50_ms"]:>8.2f} '
+              f'{result["p99_ms"]:>8.2f} {result["throughput"]:>8.1f} {result["github_calls_per_request"]:>16.2f} '
+              f'{result["not_modified_per_request"]:>8.2f} {result["emails"]:>6}')
+    github.shutdown()
+    smtp.shutdown()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    return results
+
+
+if __name__ == '__main__':
+    main()
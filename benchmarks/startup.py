@@ -0,0 +1,122 @@
+"""
+Benchmark the startup of a worker: importing the app, creating it and answering the first webhook.
+
+Each run starts a new interpreter, which imports the app, creates it against stub GitHub API and SMTP
+servers and handles a webhook notifying a watched pull request, so that the imports deferred to the
+first use are measured too. The median and maximum times of the runs are reported.
+
+    python -m benchmarks.startup --runs 20 --max-import-ms 300
+"""
+import argparse
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+STAGES = ('import', 'create_app', 'first_response', 'total')
+
+
+def make_webhook(github_url):
+    """
+    Return a watch configuration and the signed body of a webhook notifying one of its repositories.
+    """
+    from .run import (  # pylint: disable=import-outside-toplevel
+        DEFAULT_PAYLOAD, get_repo_names, make_payloads, make_watch_config,
+    )
+    watch_config = make_watch_config(10, 1)
+    with open(DEFAULT_PAYLOAD, encoding='utf-8') as payload_file:
+        template = json.load(payload_file)
+    return watch_config, make_payloads([template], get_repo_names(watch_config)[:1], 1, github_url)[0]
+
+
+def measure_startup(github_url, smtp_port):
+    """
+    Import and create the app, send it a webhook and return the time taken by each stage, in milliseconds.
+
+    This is run in a new interpreter, nothing of the app must be imported before.
+    """
+    start = time.perf_counter()
+    importlib.import_module('pr_watcher_notifier')
+    imported = time.perf_counter()
+    watch_config, (body, signature) = make_webhook(github_url)
+    from .run import make_app  # pylint: disable=import-outside-toplevel
+    created_start = time.perf_counter()
+    app = make_app(watch_config, argparse.Namespace(url=github_url), argparse.Namespace(port=smtp_port), {})
+    created = time.perf_counter()
+    response = app.test_client().post(
+        '/pull-requests',
+        data=body,
+        content_type='application/json',
+        headers={'X-Github-Event': 'pull_request', 'X-Hub-Signature-256': signature},
+    )
+    responded = time.perf_counter()
+    if response.status_code != 201:
+        raise RuntimeError(f'Unexpected response: {response.status_code}')
+    # Building the payload isn't part of the startup.
+    return {
+        'import': (imported - start) * 1000,
+        'create_app': (created - created_start) * 1000,
+        'first_response': (responded - created) * 1000,
+        'total': (responded - start - (created_start - imported)) * 1000,
+    }
+
+
+def run_child(github_url, smtp_port):
+    """
+    Measure the startup in a new interpreter.
+    """
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', github_url, str(smtp_port)],
+        check=True,
+        capture_output=True,
+        cwd=Path(__file__).parent.parent,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(argv=None):
+    """
+    Run the startup benchmark, print the median and maximum time of each stage, and check the budgets.
+
+    Return the exit status: 1 if the median time of a stage exceeds its budget, else 0.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--runs', type=int, default=10, help='number of interpreters started')
+    parser.add_argument('--json', type=Path, help='also write the results to this JSON file')
+    for stage in STAGES:
+        parser.add_argument(f'--max-{stage.replace("_", "-")}-ms', type=float, help=f'budget of the {stage} stage')
+    parser.add_argument('--child', nargs=2, metavar=('GITHUB_URL', 'SMTP_PORT'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure_startup(args.child[0], int(args.child[1]))))
+        return 0
+
+    from .stubs import StubGitHub, StubSMTP  # pylint: disable=import-outside-toplevel
+    github = StubGitHub()
+    smtp = StubSMTP()
+    runs = [run_child(github.url, smtp.port) for _ in range(args.runs)]
+    github.shutdown()
+    smtp.shutdown()
+    status = 0
+    results = {}
+    print(f'{"stage":<16} {"median ms":>10} {"max ms":>10} {"budget ms":>10}')
+    for stage in STAGES:
+        times = [run[stage] for run in runs]
+        budget = getattr(args, f'max_{stage}_ms')
+        results[stage] = {'median_ms': statistics.median(times), 'max_ms': max(times), 'budget_ms': budget}
+        over = budget is not None and results[stage]['median_ms'] > budget
+        status = status or int(over)
+        print(f'{stage:<16} {results[stage]["median_ms"]:>10.1f} {results[stage]["max_ms"]:>10.1f} '
+              f'{"-" if budget is None else f"{budget:.0f}":>10}{"  OVER BUDGET" if over else ""}')
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Stub GitHub API and SMTP servers, answering like the real ones for the calls made by the app.
+"""
+import hashlib
+import json
+import re
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PULL_FILES_RE = re.compile(r'^/repos/([^/]+/[^/]+)/pulls/(\d+)/files$')
+PULL_RE = re.compile(r'^/repos/([^/]+/[^/]+)/pulls/(\d+)$')
+COMPARE_RE = re.compile(r'^/repos/([^/]+/[^/]+)/compare/(.+)$')
+REPO_RE = re.compile(r'^/repos/([^/]+/[^/]+)$')
+
+
+def get_file_names(count):
+    """
+    Return the names of the files changed by the stub pull requests, the last one being the watched one.
+    """
+    return [f'src/package{i % 10}/module{i}.py' for i in range(count - 1)] + ['docs/decisions/0001-watched.rst']
+
+
+class GitHubHandler(BaseHTTPRequestHandler):
+    """
+    Answer the GitHub API calls made by the app with pull requests changing `server.files` files.
+    """
+    server_version = 'StubGitHub/1.0'
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if match := PULL_FILES_RE.match(url.path):
+            page = int(query.get('page', ['1'])[0])
+            per_page = int(query.get('per_page', ['30'])[0])
+            files = get_file_names(self.server.files)
+            start = (page - 1) * per_page
+            link = None
+            if start + per_page < len(files):
+                link = f'<{self.server.url}{url.path}?page={page + 1}&per_page={per_page}>; rel="next"'
+            body = [{'filename': name, 'status': 'modified'} for name in files[start:start + per_page]]
+            self.reply('pull_files', body, link)
+        elif match := PULL_RE.match(url.path):
+            repo, number = match.groups()
+            self.reply('pull', {
+                'number': int(number),
+                'url': f'{self.server.url}/repos/{repo}/pulls/{number}',
+                'base': {'ref': 'main'},
+                'head': {'sha': hashlib.sha1(self.path.encode()).hexdigest()},
+            })
+        elif match := COMPARE_RE.match(url.path):
+            files = get_file_names(self.server.files)
+            self.reply('compare', {'files': [{'filename': name, 'status': 'modified'} for name in files]})
+        elif match := REPO_RE.match(url.path):
+            repo = match.group(1)
+            self.reply('repo', {'full_name': repo, 'name': repo.split('/')[1], 'url': f'{self.server.url}{url.path}'})
+        else:
+            self.reply('not_found', {'message': 'Not Found'}, status=404)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path != '/graphql':
+            self.reply('not_found', {'message': 'Not Found'}, status=404)
+            return
+        files = get_file_names(self.server.files)
+        start = int(request['variables'].get('cursor') or 0)
+        end = start + 100
+        self.reply('graphql', {'data': {'repository': {'pullRequest': {
+            'baseRefName': 'main',
+            'files': {
+                'nodes': [{'path': name} for name in files[start:end]],
+                'pageInfo': {'hasNextPage': end < len(files), 'endCursor': str(end)},
+            },
+        }}}})
+
+    def reply(self, endpoint, body, link=None, status=200):
+        """
+        Send a JSON response, or a 304 if the client has the same response.
+        """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        payload = json.dumps(body).encode('utf-8')
+        etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+        not_modified = status == 200 and self.headers.get('If-None-Match') == etag
+        self.server.count(endpoint, not_modified)
+        if not_modified:
+            status, payload = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('ETag', etag)
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', '4999')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        if link:
+            self.send_header('Link', link)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StubGitHub(ThreadingHTTPServer):
+    """
+    A stub GitHub API server, listening on a free local port, counting the calls by endpoint.
+
+    The calls answered with a 304 are also counted in `not_modified`, and the TCP connections accepted
+    in `connections`.
+
+    `latency` seconds are waited before each response, to emulate the round trip to GitHub.
+    """
+    daemon_threads = True
+
+    def __init__(self, files=10, latency=0.0):
+        super().__init__(('127.0.0.1', 0), GitHubHandler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.files = files
+        self.latency = latency
+        self.calls = Counter()
+        self.not_modified = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, name='stub-github', daemon=True).start()
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def count(self, endpoint, not_modified=False):
+        """
+        Count a call to an endpoint, and whether it was answered with a 304.
+        """
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.not_modified += not_modified
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Accept all the emails, counting them.
+    """
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        """
+        Send a reply line.
+        """
+        self.wfile.write(f'{line}\r\n'.encode('ascii'))
+
+    def handle(self):
+        self.reply('220 stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.count()
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class StubSMTP(socketserver.ThreadingTCPServer):
+    """
+    A stub SMTP server, listening on a free local port.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.port = self.server_address[1]
+        self.messages = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, name='stub-smtp', daemon=True).start()
+
+    def count(self):
+        """
+        Count a received message.
+        """
+        with self.lock:
+            self.messages += 1
@@ -18,8 +18,22 @@ def create_app(config_obj='settings'):
     """
     app = Flask(__name__)
     from .views import APP  # pylint:disable=import-outside-toplevel
+    from .replay import replay_command  # pylint:disable=import-outside-toplevel
+    from .backfill import backfill_command  # pylint:disable=import-outside-toplevel
     app.register_blueprint(APP, url_prefix='/')
+    app.cli.add_command(replay_command)
+    app.cli.add_command(backfill_command)
     app.config.from_object(config_obj)
+    from .github_api import get_credentials  # pylint:disable=import-outside-toplevel
+    if not get_credentials(app.config):
+        raise ValueError(
+            'No GitHub credentials are configured, set GITHUB_ACCESS_TOKEN, GITHUB_ACCESS_TOKENS or GITHUB_APP_ID'
+        )
+    from .watch_config import WatchConfigIndex  # pylint:disable=import-outside-toplevel
+    app.config['WATCH_CONFIG_INDEX'] = WatchConfigIndex(app.config['WATCH_CONFIG'])
+    app.config['WATCH_CONFIG_INDEX'].compile_templates(app.jinja_env)
+    from .metrics import REGISTRY  # pylint:disable=import-outside-toplevel
+    REGISTRY.configure(app.config.get('METRICS_DIR'))
     app.logger.removeHandler(default_handler)
     console_handler = logging.StreamHandler()
     formatter = logging.Formatter('%(asctime)s | %(levelname)s | process=%(process)d | %(name)s | %(message)s')
@@ -0,0 +1,225 @@
+"""
+Evaluating the pull requests which are already open against the watch configuration, e.g. after adding patterns.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .github_api import RateLimited, iter_open_prs, iter_owner_repos
+from .ledger import DEFAULT_BACKEND, get_ledger
+from .matching import is_glob
+from .notification import send_notifications
+from .views import combine_data
+
+DEFAULT_WORKERS = 4
+
+
+class Checkpoint:
+    """
+    The repositories and pull requests already backfilled, appended to a file so that a backfill can be resumed.
+
+    Each line of the file is either a `owner/repo#number` pull request, or a `owner/repo` repository whose
+    open pull requests were all backfilled.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        if path:
+            try:
+                with open(path, encoding='utf-8') as checkpoint_file:
+                    self.done.update(line.strip() for line in checkpoint_file if line.strip())
+            except FileNotFoundError:
+                pass
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        """
+        Record that a repository or a pull request was backfilled.
+        """
+        with self.lock:
+            self.done.add(key)
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as checkpoint_file:
+                    checkpoint_file.write(f'{key}\n')
+
+
+def call_when_allowed(function, *args):
+    """
+    Call a function using the GitHub API, waiting for the rate limit to be reset as long as it's exhausted.
+    """
+    while True:
+        try:
+            return function(*args)
+        except RateLimited as exc:
+            current_app.logger.warning(f'Waiting {exc.retry_after:.0f}s: {exc}')
+            time.sleep(exc.retry_after)
+
+
+def iter_watched_repos(index):
+    """
+    Yield the names of the repositories watched by the watch configuration index, once each.
+
+    The repositories of the `org/*` keys and of the globs are listed from GitHub. The globs matching
+    several owners can't be listed, and are skipped with a warning.
+    """
+    seen = set()
+    owners = list(index.orgs)
+    for _, entry in index.globs:
+        owner = entry.key.partition('/')[0]
+        if is_glob(owner):
+            current_app.logger.warning(f'Skipped {entry.key}: the repositories of several owners can\'t be listed')
+        elif owner not in owners:
+            owners.append(owner)
+    candidates = [list(index.exact)]
+    for owner in owners:
+        candidates.append(call_when_allowed(lambda owner=owner: list(iter_owner_repos(owner))))
+    for repos in candidates:
+        for repo in repos:
+            if repo not in seen and index.lookup(repo)[0]:
+                seen.add(repo)
+                yield repo
+
+
+def make_event(repo, pr_data):
+    """
+    Make the data of an `opened` webhook event for an open pull request.
+    """
+    return {
+        'action': 'opened',
+        'number': pr_data['number'],
+        'repository': {'full_name': repo, 'private': pr_data['base']['repo']['private']},
+        'pull_request': pr_data,
+    }
+
+
+def backfill_pull_request(data, dry_run):
+    """
+    Match an open pull request against the watch configuration and send the notification, if it wasn't already.
+
+    Return the outcome: `ignored`, `already_notified` or `notified`.
+    """
+    repo = data['repository']['full_name']
+    pr_number = data['number']
+    call_when_allowed(combine_data, data, current_app.config['WATCH_CONFIG_INDEX'])
+    if not data['notify']:
+        return 'ignored'
+    patterns = data['watch_config']['patterns']
+    ledger = get_ledger()
+    if ledger.was_notified(repo, pr_number, patterns):
+        return 'already_notified'
+    if dry_run:
+        current_app.logger.info(f'Match (dry run): {repo} #{pr_number}')
+    else:
+        current_app.logger.info(f'Match: {repo} #{pr_number}')
+        send_notifications(data)
+        ledger.record_notification(repo, pr_number, patterns)
+    return 'notified'
+
+
+def backfill_job(app, data, dry_run, checkpoint):
+    """
+    Backfill a pull request in a worker thread, recording it in the checkpoint.
+    """
+    key = f'{data["repository"]["full_name"]}#{data["number"]}'
+    with app.app_context():
+        try:
+            outcome = backfill_pull_request(data, dry_run)
+        except Exception:  # pylint: disable=broad-exception-caught
+            app.logger.exception(f'Failed to backfill {key}')
+            return 'errors'
+    checkpoint.add(key)
+    return outcome
+
+
+def backfill(app, workers, dry_run, checkpoint):
+    """
+    Backfill the open pull requests of the watched repositories on a pool of `workers` threads.
+
+    The pull requests are listed as the workers process them, keeping a bounded number in flight.
+    A repository is recorded in the checkpoint once all its open pull requests were backfilled
+    successfully, so that the failed ones are retried when the backfill is resumed.
+    """
+    stats = Counter()
+    pending = {}
+    remaining = Counter()
+    failed = set()
+
+    def finish(repo):
+        remaining[repo] -= 1
+        if not remaining[repo]:
+            del remaining[repo]
+            if repo not in failed:
+                checkpoint.add(repo)
+
+    def collect(done):
+        for future in done:
+            repo = pending.pop(future)
+            outcome = future.result()
+            stats[outcome] += 1
+            if outcome == 'errors':
+                failed.add(repo)
+            finish(repo)
+
+    def list_open_prs(repo):
+        # The listing is restarted after waiting for the rate limit, the submitted pull requests are skipped.
+        for pr_data in iter_open_prs(repo):
+            key = f'{repo}#{pr_data["number"]}'
+            if key in checkpoint or key in submitted:
+                continue
+            submitted.add(key)
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            remaining[repo] += 1
+            pending[executor.submit(backfill_job, app, make_event(repo, pr_data), dry_run, checkpoint)] = repo
+
+    submitted = set()
+    with ThreadPoolExecutor(workers) as executor:
+        for repo in iter_watched_repos(app.config['WATCH_CONFIG_INDEX']):
+            stats['repos'] += 1
+            if repo in checkpoint:
+                continue
+            # Keep the repository pending while its pull requests are listed.
+            remaining[repo] += 1
+            call_when_allowed(list_open_prs, repo)
+            finish(repo)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    stats['pull_requests'] = sum(stats[outcome] for outcome in ('ignored', 'already_notified', 'notified', 'errors'))
+    return stats
+
+
+@click.command('backfill')
+@click.option('--dry-run', is_flag=True, help='Only log the notifications which would be sent.')
+@click.option('--workers', type=int, default=DEFAULT_WORKERS, show_default=True,
+              help='The number of pull requests processed concurrently.')
+@click.option('--checkpoint', 'checkpoint_file', type=click.Path(dir_okay=False),
+              help='A file recording the progress, to resume an interrupted backfill.')
+@with_appcontext
+def backfill_command(dry_run, workers, checkpoint_file):
+    """
+    Send the notifications for the open pull requests of the watched repositories which weren't notified yet.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    if not dry_run and app.config.get('NOTIFICATION_LEDGER_BACKEND', DEFAULT_BACKEND) != 'sqlite':
+        # The notifications sent by the app wouldn't be known, and they would be sent again.
+        raise click.UsageError(
+            'The backfill needs the notification ledger of the app, set NOTIFICATION_LEDGER_BACKEND=sqlite'
+        )
+    stats = backfill(app, workers, dry_run, Checkpoint(checkpoint_file))
+    notified = 'Would notify' if dry_run else 'Notified'
+    click.echo(f'Repositories: {stats["repos"]}')
+    click.echo(f'Pull requests: {stats["pull_requests"]}')
+    click.echo(f'{notified}: {stats["notified"]}')
+    click.echo(f'Already notified: {stats["already_notified"]}')
+    if stats['errors']:
+        click.echo(f'Errors: {stats["errors"]}')
@@ -0,0 +1,178 @@
+"""
+Size-bounded LRU caches with expiry, kept in memory or in a SQLite database shared by the processes.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from . import metrics
+from .database import SQLiteConnections
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class BaseCache:
+    """
+    Common bookkeeping of the hit and miss counters.
+    """
+    name = None
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the cached value for the given key, or None if it is missing or expired.
+        """
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if self.name is not None:
+            metrics.inc(
+                'pr_watcher_cache_requests_total', {'cache': self.name, 'result': 'miss' if value is None else 'hit'}
+            )
+        return value
+
+    def set(self, key, value):
+        """
+        Cache a JSON-serializable value under the given key.
+        """
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Return the hit and miss counters of the cache in this process.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class MemoryCache(BaseCache):
+    """
+    A cache local to the process.
+
+    Besides the number of entries, the size of the cached values, as JSON, is bounded by `max_bytes`.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(max_entries, ttl)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value, _ = entry
+            if expires < time.time():
+                self._delete(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(json.dumps(value))
+        with self.lock:
+            if key in self.entries:
+                self._delete(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (time.time() + self.ttl, value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._delete(next(iter(self.entries)))
+
+    def _delete(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+
+class SQLiteCache(BaseCache):
+    """
+    A cache stored in a SQLite database, so that all the gunicorn workers share the cached values.
+    """
+    def __init__(self, path, namespace, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        super().__init__(max_entries, ttl)
+        self.namespace = namespace
+        self.connections = SQLiteConnections(path)
+        with self.connections.get() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'expires REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (namespace, key))'
+            )
+
+    def _get(self, key):
+        now = time.time()
+        key = json.dumps(key)
+        with self.connections.get() as conn:
+            row = conn.execute(
+                'SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires >= ?',
+                (self.namespace, key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?', (now, self.namespace, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self.connections.get() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (namespace, key, value, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                (self.namespace, json.dumps(key), json.dumps(value), now + self.ttl, now),
+            )
+            conn.execute(
+                'DELETE FROM cache WHERE namespace = ? AND (expires < ? OR key IN ('
+                'SELECT key FROM cache WHERE namespace = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?))',
+                (self.namespace, now, self.namespace, self.max_entries),
+            )
+
+
+_lock = threading.Lock()
+
+
+def get_cache(name):
+    """
+    Return the named cache of the current application, creating it as configured on first use.
+
+    The cache backend is chosen with the `GITHUB_CACHE_BACKEND` setting, which is either `memory`
+    (the default, bounded to `GITHUB_CACHE_MAX_BYTES` per cache) or `sqlite`, in which case the
+    database is stored at `GITHUB_CACHE_PATH`.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with _lock:
+        caches = app.extensions.setdefault('pr_watcher_caches', {})
+        cache = caches.get(name)
+        if cache is None:
+            max_entries = app.config.get('GITHUB_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+            ttl = app.config.get('GITHUB_CACHE_TTL', DEFAULT_TTL)
+            if app.config.get('GITHUB_CACHE_BACKEND', 'memory') == 'sqlite':
+                cache = SQLiteCache(app.config['GITHUB_CACHE_PATH'], name, max_entries, ttl)
+            else:
+                cache = MemoryCache(max_entries, ttl, app.config.get('GITHUB_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+            cache.name = name
+            caches[name] = cache
+        return cache
+
+
+def get_cache_stats():
+    """
+    Return the hit and miss counters of all the caches of the current application.
+    """
+    return {name: cache.stats() for name, cache in current_app.extensions.get('pr_watcher_caches', {}).items()}
@@ -0,0 +1,111 @@
+"""
+Conditional GitHub API requests, revalidating the cached responses with their ETag.
+
+A `304 Not Modified` response has no payload and doesn't count against the GitHub API rate limit.
+"""
+import hashlib
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from . import metrics
+
+MAX_BODY_SIZE = 256 * 1024
+# The headers describing the encoding of the payload on the wire, which don't apply to the cached payload.
+TRANSFER_HEADERS = frozenset(('content-encoding', 'content-length', 'transfer-encoding'))
+
+
+def get_cache_key(request):
+    """
+    Return the cache key of a request: the responses vary with the URL, the media type and the credentials.
+    """
+    authorization = request.headers.get('Authorization', '')
+    return (
+        request.url,
+        request.headers.get('Accept', ''),
+        hashlib.sha256(authorization.encode('utf-8')).hexdigest(),
+    )
+
+
+def make_response(request, headers, body):
+    """
+    Make the response to a request from a cached response.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body.encode('utf-8')  # pylint: disable=protected-access
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class ConditionalAdapter(HTTPAdapter):
+    """
+    A transport adapter sending the GET requests with the ETag of the cached response, if any.
+
+    The responses with an ETag are cached, as long as they are small enough. When the server answers
+    that the cached response is still valid, it is returned with the headers of the new response, so
+    that the rate limit reported to PyGithub is up to date.
+    """
+    def __init__(self, cache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request, stream=False, **kwargs):  # pylint: disable=arguments-differ
+        if request.method != 'GET' or stream:
+            return super().send(request, stream=stream, **kwargs)
+        key = get_cache_key(request)
+        cached = self.cache.get(key)
+        if cached is not None:
+            request.headers['If-None-Match'] = cached[0]
+        response = super().send(request, stream=stream, **kwargs)
+        if cached is not None and response.status_code == 304:
+            metrics.inc('pr_watcher_github_conditional_requests_total', {'result': 'not_modified'})
+            headers = dict(cached[1])
+            headers.update(
+                (name, value) for name, value in response.headers.items() if name.lower() not in TRANSFER_HEADERS
+            )
+            # Reading the empty body releases the connection to the pool, instead of closing it.
+            _ = response.content
+            response.close()
+            return make_response(request, headers, cached[2])
+        if cached is not None:
+            metrics.inc('pr_watcher_github_conditional_requests_total', {'result': 'modified'})
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag and len(response.content) <= MAX_BODY_SIZE:
+            try:
+                body = response.content.decode('utf-8')
+            except UnicodeDecodeError:
+                return response
+            headers = {name: value for name, value in response.headers.items() if name.lower() not in TRANSFER_HEADERS}
+            self.cache.set(key, [etag, headers, body])
+        return response
+
+
+def enable_conditional_requests(client, cache):
+    """
+    Make the GitHub client send conditional requests, revalidating the responses cached in `cache`.
+
+    PyGithub creates the connection of a client lazily, with the connection class picked for the
+    scheme of the base URL. That class is wrapped so that the adapter is mounted on the session of the
+    connection, keeping its pool size and retry policy.
+    """
+    requester = client.requester
+    connection_class = requester._Requester__connectionClass  # pylint: disable=protected-access
+
+    def make_connection(*args, **kwargs):
+        connection = connection_class(*args, **kwargs)
+        connection.adapter = ConditionalAdapter(
+            cache,
+            max_retries=connection.retry,
+            pool_connections=connection.pool_size,
+            pool_maxsize=connection.pool_size,
+        )
+        connection.session.mount(f'{connection.protocol}://', connection.adapter)
+        return connection
+
+    requester._Requester__connectionClass = make_connection  # pylint: disable=protected-access
+    return client
@@ -0,0 +1,28 @@
+"""
+The connections to the SQLite databases shared by the processes: the cache, the ledger and the digests.
+"""
+import os
+import sqlite3
+import threading
+
+
+class SQLiteConnections:
+    """
+    The connections to a SQLite database, one per thread and process, since they can't be shared.
+
+    The database is in WAL mode, so that the readers don't block the writer.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def get(self):
+        """
+        Return the database connection of the current thread and process.
+        """
+        conn, pid = getattr(self.local, 'connection', (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = (conn, os.getpid())
+        return conn
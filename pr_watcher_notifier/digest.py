@@ -0,0 +1,209 @@
+"""
+Coalescing the notifications of a time window into a single digest email per recipient list.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+from flask import current_app, render_template
+from flask_mail import Message
+
+from .database import SQLiteConnections
+from .mailer import get_mailer
+from .watch_config import WatchedRepoEntry, get_digest_settings
+
+DEFAULT_BACKEND = 'sqlite'
+DEFAULT_PATH = 'digest.sqlite3'
+POLL_INTERVAL = 5
+# The delay before sending again a digest which couldn't be sent.
+RETRY_DELAY = 300
+
+
+def get_digest_templates(subject, body):
+    """
+    Return the compiled subject and body templates of a digest.
+
+    The templates are compiled once when the watch configuration is loaded. The digests of the
+    configurations which are no longer part of the loaded watch configuration are compiled on demand.
+    """
+    for entry in current_app.config['WATCH_CONFIG_INDEX'].entries:
+        if entry.digest_body_template is not None and get_digest_settings(entry.config)[1:] == (subject, body):
+            return entry.digest_subject_template, entry.digest_body_template
+    entry = WatchedRepoEntry(0, '', {'digest': {'subject': subject, 'body': body}})
+    entry.compile_templates(current_app.jinja_env)
+    return entry.digest_subject_template, entry.digest_body_template
+
+
+def make_digest_email(recipients, events, subject, body):
+    """
+    Make a digest email from the notification contexts of several events.
+    """
+    context = {'events': events, 'to': list(recipients)}
+    subject_template, body_template = get_digest_templates(subject, body)
+    msg = Message(render_template(subject_template, **context), recipients=list(recipients))
+    msg.body = render_template(body_template, **context)
+    return msg
+
+
+class MemoryDigestStore:
+    """
+    The pending events of the digests, local to the process, mostly useful for tests.
+    """
+    shared = False
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, context, deadline):
+        """
+        Add an event to the digest with the given key, which is due at `deadline` unless it already has events.
+
+        Return the number of events of the digest and its deadline.
+        """
+        with self.lock:
+            deadline, events = self.pending.setdefault(key, (deadline, []))
+            events.append(context)
+            return len(events), deadline
+
+    def pop_due(self, now, force=False):
+        """
+        Remove the digests due at `now`, or all of them if `force` is set, and return their keys and events.
+        """
+        with self.lock:
+            due = [key for key, (deadline, _) in self.pending.items() if force or deadline <= now]
+            return [(key, self.pending.pop(key)[1]) for key in due]
+
+
+class SQLiteDigestStore:
+    """
+    The pending events of the digests, stored in a SQLite database shared by the processes and kept across restarts.
+
+    A due digest is removed from the database in the transaction which reads it, so that a single
+    process sends it.
+    """
+    shared = True
+
+    def __init__(self, path):
+        self.connections = SQLiteConnections(path)
+        with self.connections.get() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS digest_events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'key TEXT NOT NULL, deadline REAL NOT NULL, context TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS digest_events_key ON digest_events (key)')
+
+    def add(self, key, context, deadline):
+        """
+        Add an event to the digest with the given key, which is due at `deadline` unless it already has events.
+
+        Return the number of events of the digest and its deadline.
+        """
+        conn = self.connections.get()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO digest_events (key, deadline, context) '
+                'VALUES (?, COALESCE((SELECT MIN(deadline) FROM digest_events WHERE key = ?), ?), ?)',
+                (key, key, deadline, json.dumps(context)),
+            )
+            return conn.execute(
+                'SELECT COUNT(*), MIN(deadline) FROM digest_events WHERE key = ?', (key,)
+            ).fetchone()
+
+    def pop_due(self, now, force=False):
+        """
+        Remove the digests due at `now`, or all of them if `force` is set, and return their keys and events.
+        """
+        conn = self.connections.get()
+        batches = {}
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            due = 'SELECT key FROM digest_events GROUP BY key HAVING ? OR MIN(deadline) <= ?'
+            for key, context in conn.execute(
+                f'SELECT key, context FROM digest_events WHERE key IN ({due}) ORDER BY id', (force, now)
+            ):
+                batches.setdefault(key, []).append(json.loads(context))
+            conn.execute(f'DELETE FROM digest_events WHERE key IN ({due})', (force, now))
+        return list(batches.items())
+
+
+class Digest:
+    """
+    The notification contexts accumulated per recipient list, sent by a background thread when their window ends.
+    """
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+        self.thread = threading.Thread(target=self._run, name='pr-watcher-digest', daemon=True)
+        self.thread.start()
+
+    def add(self, context, window, subject, body):
+        """
+        Add the notification context of an event to the digest of its recipients.
+        """
+        recipients = context['to']
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        key = json.dumps([recipients, subject, body])
+        count, deadline = self.store.add(key, context, time.time() + window)
+        current_app.logger.info(
+            f'Added {context["repo"]} #{context["number"]} to the digest for {recipients!r}, '
+            f'{count} events due in {deadline - time.time():.0f}s'
+        )
+
+    def _run(self):
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.app.logger.exception('Failed to retrieve the due digests')
+
+    def flush(self, force=False):
+        """
+        Send the digests whose window ended, or all of them if `force` is set.
+
+        The digests which can't be sent are sent again later.
+        """
+        with self.app.app_context():
+            for key, events in self.store.pop_due(time.time(), force):
+                recipients, subject, body = json.loads(key)
+                try:
+                    email = make_digest_email(recipients, events, subject, body)
+                    self.app.logger.info(f'Sending a digest of {len(events)} events to {recipients!r}')
+                    get_mailer().send(email)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    self.app.logger.exception(f'Failed to send the digest to {recipients!r}')
+                    if not force:
+                        for context in events:
+                            self.store.add(key, context, time.time() + RETRY_DELAY)
+
+
+_lock = threading.Lock()
+
+
+def get_digest():
+    """
+    Return the digest of the current application, creating it in the current process if needed.
+
+    The pending events are stored as configured with the `DIGEST_BACKEND` setting, which is either
+    `sqlite` (the default), in which case the database is stored at `DIGEST_PATH` and shared by the
+    processes, which send each digest once, or `memory`. The digests kept in memory are sent when
+    the process exits.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with _lock:
+        digest, pid = app.extensions.get('pr_watcher_digest', (None, None))
+        if digest is None or pid != os.getpid():
+            if app.config.get('DIGEST_BACKEND', DEFAULT_BACKEND) == 'sqlite':
+                store = SQLiteDigestStore(app.config.get('DIGEST_PATH', DEFAULT_PATH))
+            else:
+                store = MemoryDigestStore()
+            digest = Digest(app, store)
+            if not store.shared:
+                atexit.register(digest.flush, force=True)
+            app.extensions['pr_watcher_digest'] = (digest, os.getpid())
+        return digest
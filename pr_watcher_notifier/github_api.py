@@ -1,41 +1,307 @@
 """
 Utility functions for interacting with the GitHub API.
+
+PyGithub and requests are only imported when the GitHub API is first used, since importing them
+takes longer than starting the rest of the app, which slows down starting the workers.
 """
+import copy
 import hashlib
 import hmac
+import threading
+import time
+from contextlib import contextmanager
 
 from flask import current_app
-from github import Github
+from . import metrics
+from .cache import get_cache
+from .github_graphql import GraphQLPullRequest, is_rate_limited
+
+DEFAULT_BASE_URL = 'https://api.github.com'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 10
+DEFAULT_RATE_LIMIT_RESERVE = 100
+DEFAULT_RETRY_AFTER = 60
+
+_clients_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """
+    Raised when the GitHub API rate limit of all the configured credentials is nearly exhausted.
+
+    `retry_after` is the number of seconds until a rate limit window is reset.
+    """
+    def __init__(self, retry_after):
+        super().__init__(f'The GitHub API rate limit is nearly exhausted, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+class ClientPool:
+    """
+    A GitHub client per configured credential, picked according to their remaining rate limit.
+
+    The remaining requests and the reset time of each client are those of the `X-RateLimit-*` headers
+    of its last response. The client with the most remaining requests is used, as long as more than
+    `reserve` requests remain, so that the calls are spread across the credentials.
+    """
+    def __init__(self, clients, reserve=DEFAULT_RATE_LIMIT_RESERVE):
+        self.clients = clients
+        self.reserve = reserve
+
+    def acquire(self):
+        """
+        Return the client with the most remaining requests, or raise `RateLimited` if none has enough left.
+        """
+        now = time.time()
+        best, best_remaining = None, -1
+        for client in self.clients:
+            remaining, _ = client.requester.rate_limiting
+            if remaining < 0 or client.requester.rate_limiting_resettime <= now:
+                # Nothing is known yet, or the rate limit window was reset since the last response.
+                return client
+            if remaining > best_remaining:
+                best, best_remaining = client, remaining
+        if best_remaining <= self.reserve:
+            reset = min(client.requester.rate_limiting_resettime for client in self.clients)
+            raise RateLimited(max(reset - now, 1))
+        return best
+
+    def remaining(self):
+        """
+        Return the total number of requests remaining for the clients which received a response.
+        """
+        return sum(max(client.requester.rate_limiting[0], 0) for client in self.clients)
+
+
+def get_credentials(config):
+    """
+    Return the GitHub credentials configured: the access tokens and the GitHub App installation.
+    """
+    tokens = [config.get('GITHUB_ACCESS_TOKEN')] + list(config.get('GITHUB_ACCESS_TOKENS') or [])
+    credentials = [('token', token) for token in dict.fromkeys(tokens) if token]
+    if config.get('GITHUB_APP_ID'):
+        credentials.append((
+            'app', config['GITHUB_APP_ID'], config['GITHUB_APP_PRIVATE_KEY'], config['GITHUB_APP_INSTALLATION_ID'],
+        ))
+    return tuple(credentials)
+
+
+def get_auth(credential):
+    """
+    Return the PyGithub authentication for a credential returned by `get_credentials`.
+
+    The GitHub App installation tokens are requested and renewed by PyGithub as needed.
+    """
+    from github import Auth  # pylint:disable=import-outside-toplevel
+    if credential[0] == 'app':
+        _, app_id, private_key, installation_id = credential
+        return Auth.AppAuth(app_id, private_key).get_installation_auth(int(installation_id))
+    return Auth.Token(credential[1])
+
+
+def get_retry_after(exc):
+    """
+    Return the number of seconds to wait before retrying after a GitHub rate limit error.
+    """
+    headers = {name.lower(): value for name, value in (exc.headers or {}).items()}
+    if headers.get('retry-after'):
+        return max(float(headers['retry-after']), 1)
+    if headers.get('x-ratelimit-reset'):
+        return max(float(headers['x-ratelimit-reset']) - time.time(), 1)
+    return DEFAULT_RETRY_AFTER
+
+
+@contextmanager
+def raise_rate_limited():
+    """
+    Turn the rate limit errors of the GitHub API into `RateLimited`.
+    """
+    from github import GithubException, RateLimitExceededException  # pylint:disable=import-outside-toplevel
+    try:
+        yield
+    except RateLimitExceededException as exc:
+        raise RateLimited(get_retry_after(exc)) from exc
+    except GithubException as exc:
+        if is_rate_limited(exc.data):
+            raise RateLimited(get_retry_after(exc)) from exc
+        raise
 
 
 def is_signature_valid(request_obj):
     """
     Check the HMAC signature and return if it is valid or not.
+
+    The SHA-256 signature of the `X-Hub-Signature-256` header is checked, or the SHA-1 one of the
+    `X-Hub-Signature` header for the webhooks which only have that one.
     """
-    signature = request_obj.headers.get('X-Hub-Signature')
-    if signature is not None:
-        secret = current_app.config['GITHUB_WEBHOOK_SECRET'].encode('utf-8')
-        mac = hmac.new(secret, msg=request_obj.data, digestmod=hashlib.sha1)
-        return hmac.compare_digest(f'sha1={mac.hexdigest()}', signature)
+    for header, algorithm in (('X-Hub-Signature-256', 'sha256'), ('X-Hub-Signature', 'sha1')):
+        signature = request_obj.headers.get(header)
+        if signature is not None:
+            secret = current_app.config['GITHUB_WEBHOOK_SECRET'].encode('utf-8')
+            mac = hmac.new(secret, msg=request_obj.get_data(), digestmod=getattr(hashlib, algorithm))
+            return hmac.compare_digest(f'{algorithm}={mac.hexdigest()}', signature)
     return False
 
 
+def enable_keep_alive(client):
+    """
+    Make the GitHub client reuse its connections to the GitHub API, along with their TLS sessions.
+
+    PyGithub closes the connection of a client, and its requests session, before each request, and
+    creates a new one. The connection class is wrapped so that a single connection is created, whose
+    session keeps the pool of connections. Each request gets a copy of it sharing the session, since
+    the request is stored in the connection until the response is read, and the copies aren't closed.
+    """
+    requester = client.requester
+    connection_class = requester._Requester__connectionClass  # pylint: disable=protected-access
+    connections = {}
+    lock = threading.Lock()
+
+    def make_connection(*args, **kwargs):
+        with lock:
+            if args not in connections:
+                connections[args] = connection_class(*args, **kwargs)
+            connection = copy.copy(connections[args])
+        connection.close = lambda: None
+        return connection
+
+    requester._Requester__connectionClass = make_connection  # pylint: disable=protected-access
+    return client
+
+
+def make_client_pool(settings):
+    """
+    Create the GitHub clients for the given client settings.
+    """
+    from github import Github  # pylint:disable=import-outside-toplevel
+    from .conditional_requests import enable_conditional_requests  # pylint:disable=import-outside-toplevel
+    (
+        credentials, base_url, pool_size, timeout, retries, seconds_between_requests, reserve,
+        conditional_requests,
+    ) = settings
+    kwargs = {'retry': retries} if retries is not None else {}
+    if seconds_between_requests is not None:
+        # The GraphQL queries are POST requests, which PyGithub throttles as writes.
+        kwargs['seconds_between_requests'] = kwargs['seconds_between_writes'] = seconds_between_requests
+    clients = [
+        Github(auth=get_auth(credential), base_url=base_url, pool_size=pool_size, timeout=timeout, **kwargs)
+        for credential in credentials
+    ]
+    if conditional_requests:
+        clients = [enable_conditional_requests(client, get_cache('etags')) for client in clients]
+    return ClientPool([enable_keep_alive(client) for client in clients], reserve)
+
+
+def get_client_pool():
+    """
+    Return the GitHub clients shared by all the requests and threads of the process for the current application.
+
+    Each client keeps a pool of keep-alive connections, so the TLS handshake is only done when the
+    pool is filled up. New clients are created if the client settings change. Unless disabled with
+    `GITHUB_CONDITIONAL_REQUESTS`, the clients revalidate the responses cached in the `etags` cache
+    of the application.
+    """
+    config = current_app.config
+    key = (
+        get_credentials(config),
+        config.get('GITHUB_BASE_URL', DEFAULT_BASE_URL),
+        config.get('GITHUB_POOL_SIZE', DEFAULT_POOL_SIZE),
+        config.get('GITHUB_TIMEOUT', DEFAULT_TIMEOUT),
+        config.get('GITHUB_RETRIES'),
+        config.get('GITHUB_SECONDS_BETWEEN_REQUESTS'),
+        config.get('GITHUB_RATE_LIMIT_RESERVE', DEFAULT_RATE_LIMIT_RESERVE),
+        config.get('GITHUB_CONDITIONAL_REQUESTS', True),
+    )
+    with _clients_lock:
+        pools = current_app.extensions.setdefault('pr_watcher_github_clients', {})
+        if key not in pools:
+            pools[key] = make_client_pool(key)
+        return pools[key]
+
+
 def get_client():
     """
-    Return the GitHub client.
+    Return the GitHub client with the most remaining requests, raising `RateLimited` if none has enough left.
+    """
+    return get_client_pool().acquire()
+
+
+def count_api_call(endpoint, failed=False):
+    """
+    Count a call, or a failed call, to the given GitHub API endpoint.
+    """
+    if failed:
+        metrics.inc('pr_watcher_github_api_errors_total', {'endpoint': endpoint})
+    else:
+        metrics.inc('pr_watcher_github_api_calls_total', {'endpoint': endpoint})
+
+
+def record_rate_limit():
+    """
+    Record the remaining GitHub API rate limit, as last reported by the API responses.
     """
-    return Github(current_app.config['GITHUB_ACCESS_TOKEN'])
+    metrics.set_gauge('pr_watcher_github_rate_limit_remaining', get_client_pool().remaining())
 
 
-def get_pr(repo, pr_number):
+def iter_files(pr):
+    """
+    Yield the files of a pull request, recording the time spent retrieving them.
+    """
+    count_api_call('get_files')
+    elapsed = 0.0
+    files = iter(pr.get_files())
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                with raise_rate_limited():
+                    f = next(files)
+            except StopIteration:
+                return
+            except Exception:
+                count_api_call('get_files', failed=True)
+                raise
+            finally:
+                elapsed += time.perf_counter() - start
+            yield f
+    finally:
+        metrics.REGISTRY.observe('pr_watcher_stage_seconds', elapsed, {'stage': 'get_files'})
+        record_rate_limit()
+
+
+def get_pr(repo, pr_number, pr_data=None):
     """
     Return the pull request object for the given repository and pull request number.
+
+    When the pull request data from the webhook payload is given, the object is built from it instead
+    of being retrieved with the `get_repo` and `get_pull` API calls. The webhook payload has the same
+    shape as the API response, so the object behaves the same, and e.g. `get_files()` calls the pull
+    request files endpoint directly.
+
+    With the `graphql` API backend, the pull request is retrieved along with its first 100 files
+    with a single GraphQL query, and its files are also listed with GraphQL queries.
     """
+    graphql = current_app.config.get('GITHUB_API_BACKEND', 'rest') == 'graphql'
     try:
-        return get_client().get_repo(repo).get_pull(pr_number)
+        if pr_data:
+            if graphql:
+                return GraphQLPullRequest(get_client().requester, repo, pr_number, pr_data['base']['ref'])
+            from github.PullRequest import PullRequest  # pylint:disable=import-outside-toplevel
+            return PullRequest(get_client().requester, {}, pr_data, completed=True)
+        with metrics.timed('get_pr'), raise_rate_limited():
+            count_api_call('get_pr')
+            if graphql:
+                return GraphQLPullRequest.fetch(get_client().requester, repo, pr_number)
+            return get_client().get_repo(repo).get_pull(pr_number)
+    except RateLimited:
+        current_app.logger.warning(f'Rate limited while retrieving the details of {repo}: #{pr_number}')
+        raise
     except Exception:
         current_app.logger.error(f'Failed to retrieve the details of {repo}: #{pr_number}')
+        count_api_call('get_pr', failed=True)
         raise
+    finally:
+        record_rate_limit()
 
 
 def get_file_names(files):
@@ -45,16 +311,67 @@ def get_file_names(files):
     return [f.filename for f in files]
 
 
+def iter_pr_file_names(repo, pr, head_sha=None):
+    """
+    Yield the names of the files modified in the given pull request.
+
+    The files are retrieved page by page as they are consumed, so stopping early avoids retrieving
+    the remaining pages. When the head commit of the pull request is known, the complete list of
+    file names is cached for it, so that the other events for the same commit and the redeliveries
+    don't retrieve the list again.
+    """
+    if head_sha is None:
+        for f in iter_files(pr):
+            yield f.filename
+        return
+    cache = get_cache('pr_files')
+    key = (repo, pr.number, head_sha)
+    file_names = cache.get(key)
+    if file_names is not None:
+        yield from file_names
+        return
+    file_names = []
+    for f in iter_files(pr):
+        file_names.append(f.filename)
+        yield f.filename
+    cache.set(key, file_names)
+
+
+def get_pr_file_names(repo, pr, head_sha=None):
+    """
+    Return the names of all the files modified in the given pull request.
+    """
+    return list(iter_pr_file_names(repo, pr, head_sha))
+
+
 def get_comparison_file_names(repo, base, head):
     """
     Return the file names of the files modified in the given comparison.
+
+    The results are cached for `GITHUB_CACHE_TTL` seconds, as the base may be a branch which moves.
+    `RateLimited` is raised rather than returning an empty list when the rate limit is exhausted.
+    The GraphQL API can't compare commits, so the REST API is used whatever the API backend.
     """
-    files = []
-    try:
-        files = get_client().get_repo(repo).compare(base, head).files
-    except Exception:
-        current_app.logger.error('Failed to retrieve the files changed in the most recent update to the PR')
-    return get_file_names(files)
+    cache = get_cache('comparisons')
+    key = (repo, base, head)
+    file_names = cache.get(key)
+    if file_names is None:
+        try:
+            with metrics.timed('compare'), raise_rate_limited():
+                count_api_call('compare')
+                files = get_client().get_repo(repo, lazy=True).compare(base, head).files
+        except RateLimited:
+            count_api_call('compare', failed=True)
+            raise
+        except Exception:
+            current_app.logger.error('Failed to retrieve the files changed in the most recent update to the PR')
+            count_api_call('compare', failed=True)
+            return []
+        finally:
+            record_rate_limit()
+        file_names = get_file_names(files)
+        cache.set(key, file_names)
+    return file_names
 
 
 def get_target_branch(pr):
@@ -62,3 +379,48 @@ def get_target_branch(pr):
     Return the target branch name of a pull request.
     """
     return pr.base.ref
+
+
+def iter_paginated(endpoint, paginated_list):
+    """
+    Yield the items of a paginated list, counting the calls and raising `RateLimited` on the rate limit errors.
+    """
+    count_api_call(endpoint)
+    items = iter(paginated_list)
+    while True:
+        try:
+            with raise_rate_limited():
+                item = next(items)
+        except StopIteration:
+            return
+        except Exception:
+            count_api_call(endpoint, failed=True)
+            raise
+        yield item
+
+
+def iter_owner_repos(owner):
+    """
+    Yield the full names of the repositories of an organization, or of a user.
+    """
+    from github import UnknownObjectException  # pylint:disable=import-outside-toplevel
+    client = get_client()
+    try:
+        with raise_rate_limited():
+            repos = client.get_organization(owner).get_repos()
+    except UnknownObjectException:
+        repos = client.get_user(owner).get_repos()
+    for repo in iter_paginated('list_repos', repos):
+        yield repo.full_name
+
+
+def iter_open_prs(repo):
+    """
+    Yield the data of the open pull requests of a repository, as in the webhook payloads.
+
+    The data is the one of the listing: `raw_data` would retrieve each pull request in full, one call
+    after another. The listing has no `merged` field, which is derived from `merged_at`.
+    """
+    for pr in iter_paginated('list_pulls', get_client().get_repo(repo, lazy=True).get_pulls(state='open')):
+        pr_data = pr._rawData  # pylint: disable=protected-access
+        yield {**pr_data, 'merged': pr_data.get('merged', pr_data.get('merged_at') is not None)}
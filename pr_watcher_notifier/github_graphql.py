@@ -0,0 +1,79 @@
+"""
+Retrieving the pull requests and their files with the GitHub GraphQL API.
+"""
+from collections import namedtuple
+
+PULL_REQUEST_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      baseRefName
+      files(first: 100, after: $cursor) {
+        nodes { path }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+  }
+}
+"""
+
+Ref = namedtuple('Ref', 'ref')
+File = namedtuple('File', 'filename')
+
+
+def query_pull_request(requester, repo, number, cursor=None):
+    """
+    Return the base branch and a page of the files of a pull request.
+    """
+    owner, name = repo.split('/', 1)
+    _, data = requester.graphql_query(
+        PULL_REQUEST_QUERY, {'owner': owner, 'name': name, 'number': number, 'cursor': cursor}
+    )
+    return data['data']['repository']['pullRequest']
+
+
+def is_rate_limited(data):
+    """
+    Return whether the errors of a GraphQL response are due to the rate limit.
+    """
+    return isinstance(data, dict) and any(error.get('type') == 'RATE_LIMITED' for error in data.get('errors', ()))
+
+
+class GraphQLPullRequest:
+    """
+    The fields of a pull request used by the app, with its files retrieved 100 at a time.
+
+    It has the same interface as the PyGithub pull request for these fields, so that the rest of the
+    app doesn't depend on the API backend.
+    """
+    def __init__(self, requester, repo, number, base_ref):
+        self.requester = requester
+        self.repo = repo
+        self.number = number
+        self.base = Ref(base_ref)
+        # The first page of files, when it was retrieved along with the base branch.
+        self.files_page = None
+
+    @classmethod
+    def fetch(cls, requester, repo, number):
+        """
+        Retrieve the base branch and the first page of files of a pull request in a single query.
+        """
+        pull_request = query_pull_request(requester, repo, number)
+        instance = cls(requester, repo, number, pull_request['baseRefName'])
+        instance.files_page = pull_request['files']
+        return instance
+
+    def get_files(self):
+        """
+        Yield the files of the pull request, retrieving the pages as they are consumed.
+        """
+        page = self.files_page
+        if page is None:
+            page = query_pull_request(self.requester, self.repo, self.number)['files']
+        while True:
+            for node in page['nodes']:
+                yield File(node['path'])
+            if not page['pageInfo']['hasNextPage']:
+                return
+            page = query_pull_request(self.requester, self.repo, self.number, page['pageInfo']['endCursor'])['files']
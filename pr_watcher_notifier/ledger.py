@@ -0,0 +1,197 @@
+"""
+A record of the webhook deliveries processed and of the notifications sent for the pull requests.
+"""
+import json
+import threading
+import time
+
+from flask import current_app
+
+from .database import SQLiteConnections
+
+DEFAULT_BACKEND = 'sqlite'
+DEFAULT_PATH = 'notification_ledger.sqlite3'
+DEFAULT_RETENTION = 90 * 24 * 3600
+DEFAULT_COMPACTION_INTERVAL = 3600
+DEFAULT_MAX_ENTRIES = 10000
+
+TABLES = ('deliveries', 'events', 'notifications')
+
+
+def patterns_key(patterns):
+    """
+    Return a canonical string for a set of patterns.
+    """
+    return json.dumps(sorted(set(patterns)))
+
+
+def notification_key(repo, pr_number, patterns):
+    """
+    Return the key recording a notification for a pull request and a set of patterns.
+    """
+    return json.dumps([repo, pr_number, patterns_key(patterns)])
+
+
+class BaseLedger:
+    """
+    The ledger operations, on top of a key store with one namespace per table.
+
+    Entries older than `retention` seconds are dropped when the ledger is compacted, which happens
+    at most every `compaction_interval` seconds when recording entries.
+    """
+    def __init__(self, retention=DEFAULT_RETENTION, compaction_interval=DEFAULT_COMPACTION_INTERVAL):
+        self.retention = retention
+        self.compaction_interval = compaction_interval
+        self.last_compaction = time.time()
+
+    def record_delivery(self, delivery_id):
+        """
+        Record that the webhook delivery with the given `X-GitHub-Delivery` id was processed.
+        """
+        self._record('deliveries', delivery_id)
+
+    def has_delivery(self, delivery_id):
+        """
+        Return whether the webhook delivery with the given id was already processed.
+        """
+        return self._contains('deliveries', delivery_id)
+
+    def record_event(self, event_key):
+        """
+        Record that the pull request event with the given key was processed.
+        """
+        self._record('events', event_key)
+
+    def has_event(self, event_key):
+        """
+        Return whether the pull request event with the given key was already processed.
+        """
+        return self._contains('events', event_key)
+
+    def record_notification(self, repo, pr_number, patterns):
+        """
+        Record that a notification was sent for the pull request and the given watched patterns.
+        """
+        self._record('notifications', notification_key(repo, pr_number, patterns))
+
+    def was_notified(self, repo, pr_number, patterns):
+        """
+        Return whether a notification was already sent for the pull request and the given watched patterns.
+        """
+        return self._contains('notifications', notification_key(repo, pr_number, patterns))
+
+    def compact(self):
+        """
+        Drop the entries older than the retention period.
+        """
+        self.last_compaction = time.time()
+        self._purge(self.last_compaction - self.retention)
+
+    def _record(self, table, key):
+        now = time.time()
+        self._store(table, key, now)
+        if now - self.last_compaction >= self.compaction_interval:
+            self.compact()
+
+    def _store(self, table, key, created):
+        raise NotImplementedError
+
+    def _contains(self, table, key):
+        raise NotImplementedError
+
+    def _purge(self, before):
+        raise NotImplementedError
+
+
+class MemoryLedger(BaseLedger):
+    """
+    A ledger local to the process, mostly useful for tests and single process deployments.
+
+    Each table keeps at most `max_entries` entries, the oldest ones being dropped first.
+    """
+    def __init__(
+        self, retention=DEFAULT_RETENTION, compaction_interval=DEFAULT_COMPACTION_INTERVAL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+    ):
+        super().__init__(retention, compaction_interval)
+        self.max_entries = max_entries
+        self.tables = {table: {} for table in TABLES}
+        self.lock = threading.Lock()
+
+    def _store(self, table, key, created):
+        with self.lock:
+            entries = self.tables[table]
+            # The dicts are kept in the order the entries were recorded in.
+            entries.pop(key, None)
+            entries[key] = created
+            while len(entries) > self.max_entries:
+                del entries[next(iter(entries))]
+
+    def _contains(self, table, key):
+        with self.lock:
+            created = self.tables[table].get(key)
+        return created is not None and created >= time.time() - self.retention
+
+    def _purge(self, before):
+        with self.lock:
+            for table in self.tables.values():
+                for key in [key for key, created in table.items() if created < before]:
+                    del table[key]
+
+
+class SQLiteLedger(BaseLedger):
+    """
+    A ledger stored in a SQLite database, shared by the processes and kept across restarts.
+    """
+    def __init__(self, path, retention=DEFAULT_RETENTION, compaction_interval=DEFAULT_COMPACTION_INTERVAL):
+        super().__init__(retention, compaction_interval)
+        self.connections = SQLiteConnections(path)
+        with self.connections.get() as conn:
+            # Only effective when the database is created, it lets the compaction return the free pages.
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            for table in TABLES:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, created REAL NOT NULL)')
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_created ON {table} (created)')
+
+    def _store(self, table, key, created):
+        with self.connections.get() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO {table} (key, created) VALUES (?, ?)', (key, created))
+
+    def _contains(self, table, key):
+        with self.connections.get() as conn:
+            row = conn.execute(
+                f'SELECT 1 FROM {table} WHERE key = ? AND created >= ?', (key, time.time() - self.retention)
+            ).fetchone()
+        return row is not None
+
+    def _purge(self, before):
+        with self.connections.get() as conn:
+            for table in TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE created < ?', (before,))
+        self.connections.get().execute('PRAGMA incremental_vacuum')
+
+
+_lock = threading.Lock()
+
+
+def get_ledger():
+    """
+    Return the ledger of the current application, creating it as configured on first use.
+
+    The backend is chosen with the `NOTIFICATION_LEDGER_BACKEND` setting, which is either `sqlite` (the
+    default), in which case the database is stored at `NOTIFICATION_LEDGER_PATH`, or `memory`, bounded to
+    `NOTIFICATION_LEDGER_MAX_ENTRIES` entries per table.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with _lock:
+        ledger = app.extensions.get('pr_watcher_ledger')
+        if ledger is None:
+            retention = app.config.get('NOTIFICATION_LEDGER_RETENTION', DEFAULT_RETENTION)
+            if app.config.get('NOTIFICATION_LEDGER_BACKEND', DEFAULT_BACKEND) == 'sqlite':
+                ledger = SQLiteLedger(app.config.get('NOTIFICATION_LEDGER_PATH', DEFAULT_PATH), retention)
+            else:
+                ledger = MemoryLedger(
+                    retention, max_entries=app.config.get('NOTIFICATION_LEDGER_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+                )
+            app.extensions['pr_watcher_ledger'] = ledger
+        return ledger
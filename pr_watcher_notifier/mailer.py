@@ -0,0 +1,185 @@
+"""
+Sending emails over a long-lived SMTP connection, either right away or in batches.
+"""
+import atexit
+import os
+import smtplib
+import threading
+import time
+
+from flask import current_app
+from flask_mail import Connection
+
+from . import metrics
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_MAX_IDLE = 30
+
+
+class PersistentConnection:
+    """
+    An SMTP connection kept open across emails, and reopened when the server drops it.
+
+    The connection is closed before sending when it was idle for longer than `max_idle` seconds,
+    since most servers drop idle connections after a while.
+    """
+    def __init__(self, mail_state, max_idle=DEFAULT_MAX_IDLE):
+        self.connection = Connection(mail_state)
+        self.max_idle = max_idle
+        self.last_used = None
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        """
+        Send a message, reconnecting and retrying once if the connection was lost.
+        """
+        with self.lock, metrics.timed('smtp_send'):
+            if self.last_used is not None and time.monotonic() - self.last_used > self.max_idle:
+                self._close()
+            try:
+                try:
+                    self._send(message)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    current_app.logger.warning('The SMTP connection was lost, reconnecting')
+                    self._close()
+                    self._send(message)
+            except Exception:
+                metrics.inc('pr_watcher_emails_total', {'result': 'failed'})
+                raise
+            metrics.inc('pr_watcher_emails_total', {'result': 'sent'})
+
+    def _send(self, message):
+        if self.last_used is None:
+            # Opens the connection, runs STARTTLS and authenticates, unless sending is suppressed.
+            self.connection.__enter__()  # pylint: disable=unnecessary-dunder-call
+        self.last_used = time.monotonic()
+        self.connection.send(message)
+
+    def _close(self):
+        host, self.connection.host, self.last_used = self.connection.host, None, None
+        if host is not None:
+            try:
+                host.quit()
+            except smtplib.SMTPException:
+                host.close()
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        with self.lock:
+            self._close()
+
+
+class MailQueue:
+    """
+    An outbound queue of emails, sent in batches over a single connection by a background thread.
+
+    A batch is sent when `batch_size` emails are queued or `flush_interval` seconds after the first
+    queued email, whichever comes first.
+    """
+    def __init__(self, app, connection, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.app = app
+        self.connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.messages = []
+        self.condition = threading.Condition()
+        self.stats = {'batches': 0, 'sent': 0, 'failed': 0, 'last_batch_seconds': 0.0}
+        self.thread = threading.Thread(target=self._run, name='pr-watcher-mail-queue', daemon=True)
+        self.thread.start()
+
+    def put(self, message):
+        """
+        Queue a message to be sent with the next batch.
+        """
+        with self.condition:
+            self.messages.append(message)
+            if len(self.messages) >= self.batch_size:
+                self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.messages)
+                self.condition.wait_for(lambda: len(self.messages) >= self.batch_size, self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Send all the queued messages over the connection.
+        """
+        with self.condition:
+            batch, self.messages = self.messages, []
+        if not batch:
+            return
+        failed = 0
+        start = time.perf_counter()
+        with self.app.app_context():
+            for message in batch:
+                try:
+                    self.connection.send(message)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    failed += 1
+                    self.app.logger.exception(f'Failed to send email to {message.recipients!r}')
+            elapsed = time.perf_counter() - start
+            self.stats['sent'] += len(batch) - failed
+            self.stats['failed'] += failed
+            self.stats['last_batch_seconds'] = elapsed
+            self.stats['batches'] += 1
+            self.app.logger.info(f'Sent a batch of {len(batch)} emails in {elapsed:.3f}s, {failed} failed')
+
+
+class Mailer:
+    """
+    Send the emails of an application over a persistent connection, optionally through a `MailQueue`.
+    """
+    def __init__(self, app):
+        self.connection = PersistentConnection(
+            app.extensions['mail'], app.config.get('MAIL_CONNECTION_MAX_IDLE', DEFAULT_MAX_IDLE)
+        )
+        self.queue = None
+        if app.config.get('MAIL_QUEUE_ENABLED', False):
+            self.queue = MailQueue(
+                app,
+                self.connection,
+                batch_size=app.config.get('MAIL_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                flush_interval=app.config.get('MAIL_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+            )
+
+    def send(self, message):
+        """
+        Send a message now, or queue it when the outbound queue is enabled.
+        """
+        if self.queue is not None:
+            self.queue.put(message)
+        else:
+            self.connection.send(message)
+
+    def shutdown(self):
+        """
+        Send the queued messages and close the connection.
+        """
+        if self.queue is not None:
+            self.queue.flush()
+        self.connection.close()
+
+
+_lock = threading.Lock()
+
+
+def get_mailer():
+    """
+    Return the mailer of the current application, creating it in the current process if needed.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with _lock:
+        mailer, pid = app.extensions.get('pr_watcher_mailer', (None, None))
+        if mailer is None or pid != os.getpid():
+            mailer = Mailer(app)
+            atexit.register(mailer.shutdown)
+            app.extensions['pr_watcher_mailer'] = (mailer, os.getpid())
+        return mailer
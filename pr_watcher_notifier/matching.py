@@ -0,0 +1,72 @@
+"""
+Precompiled shell-style wildcard matching of file and repository names.
+"""
+import re
+from fnmatch import translate
+
+GLOB_CHARACTERS = frozenset('*?[')
+
+
+def is_glob(pattern):
+    """
+    Return whether the given pattern contains any shell-style wildcard characters.
+    """
+    return not GLOB_CHARACTERS.isdisjoint(pattern)
+
+
+def compile_globs(patterns):
+    """
+    Compile a list of shell-style wildcard patterns into a single regex, or return None if the list is empty.
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{translate(pattern)})' for pattern in patterns))
+
+
+class FileMatcher:
+    """
+    Match file names against all the watched patterns of a repository at once.
+
+    All the patterns are combined into a single compiled regex, so each file name is scanned once.
+    A file name is reported once for every pattern it matches, which preserves the results of
+    matching each file against each pattern in turn.
+    """
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self.combined = compile_globs(self.patterns)
+        self.regexes = tuple(re.compile(translate(pattern)) for pattern in self.patterns)
+
+    def count(self, filename):
+        """
+        Return the number of patterns matching the given file name.
+        """
+        if self.combined is None or self.combined.match(filename) is None:
+            return 0
+        if len(self.regexes) == 1:
+            return 1
+        return sum(1 for regex in self.regexes if regex.match(filename))
+
+    def iter_matches(self, filenames):
+        """
+        Yield the matching file names in order, once for every pattern they match.
+        """
+        for filename in filenames:
+            for _ in range(self.count(filename)):
+                yield filename
+
+    def first_match(self, filenames):
+        """
+        Return the first matching file name, or None, without consuming the rest of the file names.
+        """
+        if self.combined is None:
+            return None
+        for filename in filenames:
+            if self.combined.match(filename):
+                return filename
+        return None
+
+    def any_match(self, filenames):
+        """
+        Return whether any of the file names matches, stopping at the first match.
+        """
+        return self.first_match(filenames) is not None
@@ -0,0 +1,331 @@
+"""
+Prometheus-style metrics: counters, gauges and latency histograms, aggregated across the gunicorn workers.
+
+Each process keeps its metrics in memory. When a metrics directory is configured, every process also
+writes a snapshot of its metrics to a file of that directory, at most every `FLUSH_INTERVAL` seconds,
+and the `/metrics` endpoint served by any of the processes merges the snapshots of all of them.
+
+When a process exits, or when it is found dead, its counters and histograms are added to an archive
+file of the directory and its snapshot is removed, so that the totals are kept without the files
+piling up and without the gauges of the dead processes.
+"""
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+ARCHIVE_FILENAME = 'metrics-archive.json'
+LOCK_FILENAME = 'metrics.lock'
+
+HELP = {
+    'pr_watcher_stage_seconds': 'Time spent in each stage of the webhook processing.',
+    'pr_watcher_github_api_calls_total': 'Number of GitHub API calls, by endpoint.',
+    'pr_watcher_github_api_errors_total': 'Number of failed GitHub API calls, by endpoint.',
+    'pr_watcher_github_rate_limit_remaining': 'Remaining GitHub API requests of the current rate limit window.',
+    'pr_watcher_github_conditional_requests_total': 'Number of revalidated GitHub API responses, by result.',
+    'pr_watcher_rejections_total': 'Number of webhooks rejected before processing, by reason.',
+    'pr_watcher_cache_requests_total': 'Number of cache lookups, by cache and result.',
+    'pr_watcher_emails_total': 'Number of emails sent, by result.',
+    'pr_watcher_work_queue_depth': 'Number of webhooks waiting in the work queue.',
+    'pr_watcher_deferred_jobs_total': 'Number of webhooks deferred until the GitHub API rate limit is reset.',
+}
+
+
+def labels_key(labels):
+    """
+    Return a hashable and JSON-serializable key for a dict of labels.
+    """
+    return tuple(sorted((labels or {}).items()))
+
+
+def is_process_alive(pid):
+    """
+    Return whether a process with the given pid is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshot(path):
+    """
+    Return the snapshot stored in a file, or None if it can't be read.
+    """
+    try:
+        with open(path, encoding='utf-8') as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(directory, filename, snapshot):
+    """
+    Atomically write a snapshot to a file of the directory.
+    """
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(snapshot_file.name, os.path.join(directory, filename))
+
+
+class Registry:
+    """
+    The metrics of the current process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.directory = None
+        self.last_flush = 0.0
+        self.closing_registered = False
+
+    def configure(self, directory):
+        """
+        Set the directory where the metrics of the processes are shared, or None to only keep them in memory.
+        """
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            if not self.closing_registered:
+                atexit.register(self.close)
+                self.closing_registered = True
+
+    def inc(self, name, labels=None, amount=1):
+        """
+        Increment a counter.
+        """
+        key = (name, labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self.maybe_flush()
+
+    def set(self, name, value, labels=None):
+        """
+        Set the value of a gauge.
+        """
+        with self.lock:
+            self.gauges[(name, labels_key(labels))] = (value, time.time())
+        self.maybe_flush()
+
+    def observe(self, name, value, labels=None):
+        """
+        Add an observation to a histogram.
+        """
+        key = (name, labels_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(DEFAULT_BUCKETS) + 1), 'sum': 0.0}
+            histogram['buckets'][bisect_left(DEFAULT_BUCKETS, value)] += 1
+            histogram['sum'] += value
+        self.maybe_flush()
+
+    def get_counter_values(self, name):
+        """
+        Return the values of a counter in this process, by labels.
+        """
+        with self.lock:
+            return {labels: value for (counter, labels), value in self.counters.items() if counter == name}
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable copy of the metrics of this process.
+        """
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, labels, value, ts] for (name, labels), (value, ts) in self.gauges.items()],
+                'histograms': [
+                    [name, labels, dict(h, buckets=list(h['buckets']))] for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+    def maybe_flush(self, force=False):
+        """
+        Write the snapshot of this process to the metrics directory, if it wasn't written recently.
+        """
+        if not self.directory or (not force and time.monotonic() - self.last_flush < FLUSH_INTERVAL):
+            return
+        self.last_flush = time.monotonic()
+        write_snapshot(self.directory, f'metrics-{os.getpid()}.json', self.snapshot())
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the lock of the metrics directory, which serializes the archiving of the snapshots.
+        """
+        with open(os.path.join(self.directory, LOCK_FILENAME), 'a', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def archive(self, filenames):
+        """
+        Add the counters and histograms of the snapshot files to the archive, and remove the files.
+
+        The lock of the directory must be held.
+        """
+        snapshots = [read_snapshot(os.path.join(self.directory, ARCHIVE_FILENAME))]
+        snapshots.extend(read_snapshot(os.path.join(self.directory, filename)) for filename in filenames)
+        counters, _, histograms = merge(snapshot for snapshot in snapshots if snapshot is not None)
+        write_snapshot(self.directory, ARCHIVE_FILENAME, {
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'gauges': [],
+            'histograms': [[name, labels, histogram] for (name, labels), histogram in histograms.items()],
+        })
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """
+        Archive the snapshot of this process when it exits.
+        """
+        if not self.directory:
+            return
+        try:
+            self.maybe_flush(force=True)
+            with self.locked():
+                self.archive([f'metrics-{os.getpid()}.json'])
+        except OSError:
+            pass
+        self.directory = None
+
+    def collect(self):
+        """
+        Return the snapshots of all the processes sharing the metrics directory, or of this process only.
+
+        The snapshots of the processes which no longer exist are archived first.
+        """
+        if not self.directory:
+            return [self.snapshot()]
+        self.maybe_flush(force=True)
+        with self.locked():
+            pids = {filename: filename[len('metrics-'):-len('.json')] for filename in self.list_snapshots()}
+            dead = [filename for filename, pid in pids.items() if pid.isdigit() and not is_process_alive(int(pid))]
+            if dead:
+                self.archive(dead)
+            snapshots = [read_snapshot(os.path.join(self.directory, filename)) for filename in self.list_snapshots()]
+        return [snapshot for snapshot in snapshots if snapshot is not None]
+
+    def list_snapshots(self):
+        """
+        Return the names of the snapshot files of the metrics directory, including the archive.
+        """
+        return [
+            filename for filename in os.listdir(self.directory)
+            if filename.startswith('metrics-') and filename.endswith('.json')
+        ]
+
+
+REGISTRY = Registry()
+
+
+def merge(snapshots):
+    """
+    Merge the snapshots of several processes: counters and histograms are summed, the latest gauge value wins.
+    """
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, labels_key(dict(labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value, ts in snapshot['gauges']:
+            key = (name, labels_key(dict(labels)))
+            if key not in gauges or gauges[key][1] < ts:
+                gauges[key] = (value, ts)
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, labels_key(dict(labels)))
+            merged = histograms.setdefault(key, {'buckets': [0] * (len(DEFAULT_BUCKETS) + 1), 'sum': 0.0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+            merged['sum'] += histogram['sum']
+    return counters, gauges, histograms
+
+
+def format_labels(labels, **extra):
+    """
+    Format labels in the Prometheus text format.
+    """
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def render_histogram(name, labels, histogram):
+    """
+    Return the lines of a histogram in the Prometheus text exposition format.
+    """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(DEFAULT_BUCKETS + (float('inf'),), histogram['buckets']):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append(f'{name}_bucket{format_labels(labels, le=le)} {cumulative}')
+    lines.append(f'{name}_sum{format_labels(labels)} {histogram["sum"]}')
+    lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return lines
+
+
+def render(snapshots):
+    """
+    Render the merged snapshots in the Prometheus text exposition format.
+    """
+    counters, gauges, histograms = merge(snapshots)
+    families = {}
+    for (name, labels), value in counters.items():
+        families.setdefault((name, 'counter'), []).append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), (value, _) in gauges.items():
+        families.setdefault((name, 'gauge'), []).append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), histogram in histograms.items():
+        families.setdefault((name, 'histogram'), []).extend(render_histogram(name, labels, histogram))
+    output = []
+    for (name, kind), lines in sorted(families.items()):
+        if name in HELP:
+            output.append(f'# HELP {name} {HELP[name]}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(sorted(lines))
+    return '\n'.join(output) + '\n'
+
+
+def inc(name, labels=None, amount=1):
+    """
+    Increment a counter of the process registry.
+    """
+    REGISTRY.inc(name, labels, amount)
+
+
+def set_gauge(name, value, labels=None):
+    """
+    Set a gauge of the process registry.
+    """
+    REGISTRY.set(name, value, labels)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Record the time spent in the block in the latency histogram of the given stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe('pr_watcher_stage_seconds', time.perf_counter() - start, {'stage': stage})
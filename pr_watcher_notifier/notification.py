@@ -2,10 +2,27 @@
 Utility functions for sending notifications.
 """
 
-from flask import current_app, render_template, render_template_string
+from flask import current_app, render_template
 from flask_mail import Message
 
-from . import mail
+from . import metrics
+from .digest import get_digest, get_digest_settings
+from .mailer import get_mailer
+from .watch_config import DEFAULT_BODY_TEMPLATE, WatchedRepoEntry
+
+
+def get_templates(watch_config):
+    """
+    Return the compiled subject and body templates of a repository configuration.
+
+    The templates are compiled once when the watch configuration is loaded. Configurations which
+    are not part of the loaded watch configuration are compiled on demand.
+    """
+    entry = current_app.config['WATCH_CONFIG_INDEX'].get_entry(watch_config)
+    if entry is None or entry.body_template is None:
+        entry = WatchedRepoEntry(0, '', watch_config)
+        entry.compile_templates(current_app.jinja_env)
+    return entry.subject_template, entry.body_template
 
 
 def make_email(data):
@@ -14,13 +31,10 @@ def make_email(data):
     """
     context = make_notification_context(data)
     current_app.logger.debug(f'Creating email with context: {context}')
-    # Jinja assumes HTML output, but subjects are plain text, so disable
-    # the html autoescaping.
-    subject = render_template_string(
-        f"{{% autoescape false %}}{context['subject']}{{% endautoescape %}}",
-        **context
-    )
-    body = render_template(context['body'], **context)
+    with metrics.timed('template_render'):
+        subject_template, body_template = get_templates(data['watch_config'])
+        subject = render_template(subject_template, **context)
+        body = render_template(body_template, **context)
     msg = Message(
         subject,
         recipients=context['to'],
@@ -52,7 +66,7 @@ def make_notification_context(data):
         'creator': pr_data['user']['login'],
         'to': watch_config['recipients'],
         'subject': watch_config['subject'],
-        'body': watch_config['body'] if 'body' in watch_config else 'email_body.txt',
+        'body': watch_config.get('body', DEFAULT_BODY_TEMPLATE),
         'pr_url': pr_data['_links']['html']['href'],
         'modified_files': data['modified_files'],
         'pr': pr_data,
@@ -63,7 +77,14 @@ def make_notification_context(data):
 def send_notifications(data):
     """
     Send email notifications.
+
+    The emails are sent over a persistent SMTP connection, or queued to be sent in batches when
+    `MAIL_QUEUE_ENABLED` is set. For repositories with a `digest` setting, the event is added to
+    the digest of the recipients instead.
     """
+    if data['watch_config'].get('digest'):
+        get_digest().add(make_notification_context(data), *get_digest_settings(data['watch_config']))
+        return
     email = make_email(data)
     current_app.logger.info(f"Sending email to {email.recipients!r} with subject {email.subject!r}")
-    mail.send(email)
+    get_mailer().send(email)
@@ -0,0 +1,112 @@
+"""
+Profiling the processing of sampled webhooks, to find where the time goes when the latency spikes.
+"""
+import cProfile
+import glob
+import hashlib
+import hmac
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+DEFAULT_MAX_FILES = 100
+PROFILE_HEADER = 'X-Profile-Signature'
+
+# The profiler hooks of the interpreter can't always be used by several threads at once, so a single
+# event is profiled at a time in each process.
+_lock = threading.Lock()
+
+
+def should_profile(req):
+    """
+    Return whether the processing of a webhook should be profiled.
+
+    Profiling is enabled by setting `PROFILE_DIR`. The webhooks are then sampled at `PROFILE_SAMPLE_RATE`.
+    When `PROFILE_SECRET` is set, a webhook is also profiled when it has a `X-Profile-Signature` header
+    with the HMAC-SHA256 hex digest of its body with the secret, and none is sampled by default.
+    Otherwise, all of them are profiled by default.
+    """
+    if not current_app.config.get('PROFILE_DIR'):
+        return False
+    secret = current_app.config.get('PROFILE_SECRET')
+    if random.random() < current_app.config.get('PROFILE_SAMPLE_RATE', 0.0 if secret else 1.0):
+        return True
+    signature = req.headers.get(PROFILE_HEADER)
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), req.get_data(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature.removeprefix('sha256='), expected)
+
+
+def get_github_io_time(stats):
+    """
+    Return the time spent waiting for the GitHub API, from the profiling statistics.
+
+    All the REST and GraphQL calls of PyGithub go through the raw request method of its requester.
+    """
+    return sum(
+        cumulative
+        for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items()
+        if function == '__requestRaw' and filename.endswith('Requester.py')
+    )
+
+
+def rotate_profiles(directory, max_files):
+    """
+    Remove the oldest profiles of the directory, keeping `max_files` of them.
+    """
+    profiles = sorted(glob.glob(os.path.join(directory, 'profile-*.pstats')), key=os.path.getmtime)
+    for path in profiles[:max(len(profiles) - max_files, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def profiled(name, enabled=True):
+    """
+    Profile the block with cProfile and write the statistics to a `PROFILE_DIR` file named after `name`.
+
+    The wall clock, CPU and GitHub API times are logged. The block isn't profiled if another one is
+    already being profiled in the process.
+    """
+    if not enabled or not _lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+            write_profile(profiler, name, elapsed, cpu)
+    finally:
+        _lock.release()
+
+
+def write_profile(profiler, name, elapsed, cpu):
+    """
+    Write the statistics of a profiler to the profiles directory, and log a summary of the times.
+    """
+    directory = current_app.config['PROFILE_DIR']
+    stats = pstats.Stats(profiler)
+    github_io = get_github_io_time(stats)
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    path = os.path.join(directory, f'profile-{time.time():.6f}-{os.getpid()}-{safe_name}.pstats')
+    os.makedirs(directory, exist_ok=True)
+    stats.dump_stats(path)
+    rotate_profiles(directory, current_app.config.get('PROFILE_MAX_FILES', DEFAULT_MAX_FILES))
+    current_app.logger.info(
+        f'Profiled {name}: {elapsed * 1000:.1f}ms, CPU {cpu * 1000:.1f}ms, GitHub API {github_io * 1000:.1f}ms, '
+        f'written to {path}'
+    )
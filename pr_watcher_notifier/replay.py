@@ -0,0 +1,232 @@
+"""
+Replaying recorded webhook payloads against a watch configuration, to evaluate it before deploying it.
+"""
+import json
+import math
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import metrics
+from .cache import get_cache
+from .ledger import get_ledger
+from .views import combine_data, get_rejection_reason
+from .watch_config import WatchConfigIndex, load_watch_config, validate_watch_config
+
+CHUNK_SIZE = 500
+# The number of files per page of the REST API, used to estimate the calls needed to list the files.
+FILES_PER_PAGE = 30
+
+
+def parse_record(line):
+    """
+    Return the payload and the recorded file lists of a line of the corpus, or None for a blank line.
+
+    A line is either a webhook payload, or an object with the payload under `payload` and optionally
+    the files of the pull request under `files` and those of its last update under `comparison_files`.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    record = json.loads(line)
+    if 'payload' not in record:
+        record = {'payload': record}
+    return record
+
+
+def seed_recorded_files(data, record):
+    """
+    Put the recorded file lists of an event in the caches used by the GitHub API functions.
+
+    Return whether the files of the pull request, and of the update for the `synchronize` events, were recorded.
+    """
+    pr_data = data.get('pull_request') or {}
+    head_sha = pr_data.get('head', {}).get('sha')
+    if record.get('files') is None or not head_sha:
+        return False
+    if data.get('action') == 'synchronize' and record.get('comparison_files') is None:
+        return False
+    repo = data['repository']['full_name']
+    get_cache('pr_files').set((repo, data['number'], head_sha), record['files'])
+    if data.get('action') == 'synchronize':
+        # The comparison used depends on the synchronize strategy, both are recorded.
+        for base, head in ((pr_data.get('base', {}).get('ref'), data.get('before')), (data.get('before'), head_sha)):
+            get_cache('comparisons').set((repo, base, head), record['comparison_files'])
+    return True
+
+
+def replay_record(record, recorded, stats):
+    """
+    Match a recorded event against the watch configuration, adding the outcome to `stats`.
+    """
+    data = record['payload']
+    stats['events'] += 1
+    reason = get_rejection_reason(data)
+    if reason is not None:
+        stats[f'rejected:{reason}'] += 1
+        return
+    if recorded and not seed_recorded_files(data, record):
+        stats['unrecorded'] += 1
+        return
+    index = current_app.config['WATCH_CONFIG_INDEX']
+    combine_data(data, index)
+    key = index.get_entry(data['watch_config']).key
+    stats[f'matched:{key}'] += 1
+    if recorded:
+        stats['api_calls'] += max(math.ceil(len(record['files']) / FILES_PER_PAGE), 1)
+        if data['action'] == 'synchronize' and data['modified_files']:
+            stats['api_calls'] += 1
+    if data['notify']:
+        recipients = data['watch_config']['recipients']
+        stats[f'notified:{key}'] += 1
+        stats['emails'] += 1
+        stats['recipients'] += 1 if isinstance(recipients, str) else len(recipients)
+        get_ledger().record_notification(
+            data['repository']['full_name'], data['number'], data['watch_config']['patterns']
+        )
+
+
+def replay_chunk(app, lines, recorded):
+    """
+    Replay a chunk of lines of the corpus, returning the counters of their outcomes.
+    """
+    stats = Counter()
+    with app.app_context():
+        for line in lines:
+            record = parse_record(line)
+            if record is None:
+                continue
+            try:
+                replay_record(record, recorded, stats)
+            except Exception:  # pylint: disable=broad-exception-caught
+                app.logger.exception('Failed to replay an event')
+                stats['errors'] += 1
+    return stats
+
+
+_replay_app = None
+
+
+def replay_chunk_in_process(lines, recorded):
+    """
+    Replay a chunk in a worker process forked from the command, using the app it inherited.
+    """
+    return replay_chunk(_replay_app, lines, recorded)
+
+
+def iter_chunks(corpus):
+    """
+    Yield the lines of the corpus by chunks, without reading it all.
+    """
+    chunk = []
+    for line in corpus:
+        chunk.append(line)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay(app, corpus, recorded, workers):
+    """
+    Replay a corpus on a pool of `workers`, keeping a bounded number of chunks in flight.
+
+    The recorded events are CPU bound, so they are replayed by forked processes. The events whose
+    files are retrieved from GitHub are replayed by threads.
+    """
+    global _replay_app  # pylint: disable=global-statement
+    _replay_app = app
+    if recorded:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        job = replay_chunk_in_process
+    else:
+        executor = ThreadPoolExecutor(workers)
+        job = partial(replay_chunk, app)
+    stats = Counter()
+    pending = set()
+    with executor:
+        for chunk in iter_chunks(corpus):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stats.update(future.result())
+            pending.add(executor.submit(job, chunk, recorded))
+        for future in pending:
+            stats.update(future.result())
+    return stats
+
+
+def get_api_calls():
+    """
+    Return the number of GitHub API calls made by this process.
+    """
+    return sum(metrics.REGISTRY.get_counter_values('pr_watcher_github_api_calls_total').values())
+
+
+def format_report(stats, elapsed, recorded):
+    """
+    Format the outcome of a replay, with a line per watch configuration key.
+    """
+    keys = sorted({name.split(':', 1)[1] for name in stats if name.startswith(('matched:', 'notified:'))})
+    lines = [f'{"watched repository":<40} {"matched":>10} {"notified":>10}']
+    for key in keys:
+        lines.append(f'{key:<40} {stats[f"matched:{key}"]:>10} {stats[f"notified:{key}"]:>10}')
+    lines.append('')
+    lines.append(f'Events: {stats["events"]} in {elapsed:.1f}s, {stats["events"] / max(elapsed, 1e-9):.0f} events/s')
+    for name in sorted(name for name in stats if name.startswith('rejected:')):
+        lines.append(f'Rejected ({name.split(":", 1)[1]}): {stats[name]}')
+    if recorded:
+        lines.append(f'Without recorded files: {stats["unrecorded"]}')
+    lines.append(f'Projected emails: {stats["emails"]}, to {stats["recipients"]} recipients')
+    estimated = ' (estimated, without caching)' if recorded else ''
+    lines.append(f'GitHub API calls{estimated}: {stats["api_calls"]}')
+    if stats['errors']:
+        lines.append(f'Errors: {stats["errors"]}')
+    return '\n'.join(lines)
+
+
+@click.command('replay')
+@click.argument('corpus', type=click.File('r', encoding='utf-8'))
+@click.option('--watch-config', 'watch_config_file', type=click.Path(exists=True, dir_okay=False),
+              help='The watch configuration to evaluate, instead of the current one.')
+@click.option('--github', type=click.Choice(['recorded', 'live']), default='recorded', show_default=True,
+              help='Use the file lists recorded in the corpus, or retrieve them from the GitHub API.')
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True,
+              help='The number of worker processes, or threads with the live GitHub API.')
+@click.option('--json', 'json_output', is_flag=True, help='Output the counters as JSON.')
+@with_appcontext
+def replay_command(corpus, watch_config_file, github, workers, json_output):
+    """
+    Replay a JSONL corpus of webhook payloads and report which ones would result in notifications.
+
+    Nothing is sent, and the shared caches and ledger are not used.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    if watch_config_file:
+        try:
+            watch_config = load_watch_config(watch_config_file)
+            validate_watch_config(watch_config)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint='--watch-config') from exc
+        app.config['WATCH_CONFIG_INDEX'] = WatchConfigIndex(watch_config)
+    app.config['GITHUB_CACHE_BACKEND'] = 'memory'
+    app.config['NOTIFICATION_LEDGER_BACKEND'] = 'memory'
+    recorded = github == 'recorded'
+    api_calls = get_api_calls()
+    start = time.perf_counter()
+    stats = replay(app, corpus, recorded, workers)
+    elapsed = time.perf_counter() - start
+    if not recorded:
+        stats['api_calls'] = get_api_calls() - api_calls
+    if json_output:
+        click.echo(json.dumps({'elapsed': elapsed, **stats}, indent=2, sort_keys=True))
+    else:
+        click.echo(format_report(stats, elapsed, recorded))
@@ -0,0 +1,120 @@
+"""
+Unit tests for the backfill command.
+"""
+import pytest
+
+from .conftest import get_dummy_pr_with_list_of_files
+from .github_api import RateLimited
+
+
+@pytest.fixture(autouse=True)
+def sqlite_ledger(app, tmp_path):
+    """
+    Fixture that makes the app use a SQLite notification ledger, which the backfill requires.
+    """
+    app.config['NOTIFICATION_LEDGER_BACKEND'] = 'sqlite'
+    app.config['NOTIFICATION_LEDGER_PATH'] = str(tmp_path / 'ledger.sqlite3')
+
+
+def make_pr_data(number, private=False):
+    """
+    Make the data of an open pull request, as listed by the GitHub API.
+    """
+    return {
+        'number': number,
+        'merged': False,
+        'user': {'login': 'someone'},
+        'head': {'sha': f'sha{number}'},
+        'base': {'ref': 'main', 'repo': {'private': private}},
+        '_links': {'html': {'href': f'https://github.com/a/b/pull/{number}'}},
+    }
+
+
+def mock_github(mocker, open_prs, files=('documents/a',)):
+    """
+    Mock the listing of the repositories and of their open pull requests.
+    """
+    mocker.patch('pr_watcher_notifier.backfill.iter_owner_repos', side_effect=lambda owner: iter([f'{owner}/x']))
+    mocker.patch('pr_watcher_notifier.backfill.iter_open_prs', side_effect=lambda repo: iter(open_prs.get(repo, [])))
+    mocker.patch('pr_watcher_notifier.views.get_pr', return_value=get_dummy_pr_with_list_of_files(list(files)))
+    return mocker.patch('pr_watcher_notifier.backfill.send_notifications')
+
+
+def test_backfill_notifies_the_open_pull_requests(app, mocker):
+    """
+    Test that the open pull requests of the exact and organization keys are notified once.
+    """
+    send_notifications = mock_github(mocker, {
+        'a/b': [make_pr_data(1), make_pr_data(2)],
+        'b/x': [make_pr_data(3)],
+        'c/d': [make_pr_data(4, private=True)],
+    })
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['backfill', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Repositories: 3' in result.output
+    assert 'Pull requests: 4' in result.output
+    assert 'Notified: 4' in result.output
+    assert send_notifications.call_count == 4
+    calls = send_notifications.call_args_list
+    notified = sorted((data['repository']['full_name'], data['number']) for (data,), _ in calls)
+    assert notified == [('a/b', 1), ('a/b', 2), ('b/x', 3), ('c/d', 4)]
+
+    result = runner.invoke(args=['backfill'])
+    assert 'Already notified: 4' in result.output
+    assert send_notifications.call_count == 4
+
+
+def test_backfill_dry_run(app, mocker):
+    """
+    Test that nothing is sent in a dry run.
+    """
+    send_notifications = mock_github(mocker, {'a/b': [make_pr_data(1)]}, files=['src/a.py'])
+    result = app.test_cli_runner().invoke(args=['backfill', '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert 'Would notify: 0' in result.output
+    assert 'Pull requests: 1' in result.output
+    send_notifications.assert_not_called()
+
+
+def test_backfill_requires_the_sqlite_ledger(app, mocker):
+    """
+    Test that the backfill refuses to send notifications without the ledger shared with the app.
+    """
+    send_notifications = mock_github(mocker, {'a/b': [make_pr_data(1)]})
+    app.config['NOTIFICATION_LEDGER_BACKEND'] = 'memory'
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['backfill'])
+    assert result.exit_code == 2
+    assert 'NOTIFICATION_LEDGER_BACKEND=sqlite' in result.output
+    assert runner.invoke(args=['backfill', '--dry-run']).exit_code == 0
+    send_notifications.assert_not_called()
+
+
+def test_backfill_resumes_from_the_checkpoint(app, mocker, tmp_path):
+    """
+    Test that the repositories and pull requests in the checkpoint are skipped, and that rate limits are waited for.
+    """
+    send_notifications = mock_github(mocker, {'a/b': [make_pr_data(1), make_pr_data(2)], 'c/d': [make_pr_data(3)]})
+    sleep = mocker.patch('pr_watcher_notifier.backfill.time.sleep')
+    mocker.patch('pr_watcher_notifier.backfill.iter_owner_repos', side_effect=[RateLimited(5), iter(['b/x'])])
+    checkpoint = tmp_path / 'checkpoint.txt'
+    checkpoint.write_text('a/b#1\nc/d\n', encoding='utf-8')
+    result = app.test_cli_runner().invoke(args=['backfill', '--checkpoint', str(checkpoint)])
+    assert result.exit_code == 0, result.output
+    sleep.assert_called_once_with(5)
+    assert [data['number'] for (data,), _ in send_notifications.call_args_list] == [2]
+    assert set(checkpoint.read_text(encoding='utf-8').split()) == {'a/b#1', 'a/b#2', 'a/b', 'b/x', 'c/d'}
+
+
+def test_repos_with_failed_pull_requests_are_not_checkpointed(app, mocker, tmp_path):
+    """
+    Test that a repository is only recorded in the checkpoint when all its pull requests were backfilled.
+    """
+    send_notifications = mock_github(mocker, {'a/b': [make_pr_data(1), make_pr_data(2)], 'c/d': [make_pr_data(3)]})
+    send_notifications.side_effect = lambda data: data['number'] == 2 and 1 / 0
+    checkpoint = tmp_path / 'checkpoint.txt'
+    result = app.test_cli_runner().invoke(args=['backfill', '--checkpoint', str(checkpoint)])
+    assert result.exit_code == 0, result.output
+    assert 'Errors: 1' in result.output
+    assert set(checkpoint.read_text(encoding='utf-8').split()) == {'a/b#1', 'b/x', 'c/d#3', 'c/d'}
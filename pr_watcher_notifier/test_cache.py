@@ -0,0 +1,96 @@
+"""
+Unit tests for the caches.
+"""
+import pytest
+
+from .cache import MemoryCache, SQLiteCache, get_cache, get_cache_stats
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    """
+    Fixture that returns a factory for both types of caches.
+    """
+    def _inner(**kwargs):
+        if request.param == 'sqlite':
+            return SQLiteCache(str(tmp_path / 'cache.sqlite3'), 'test', **kwargs)
+        return MemoryCache(**kwargs)
+    return _inner
+
+
+def test_hits_and_misses(make_cache):
+    """
+    Test that the cached values are returned and the counters updated.
+    """
+    cache = make_cache()
+    assert cache.get(('a/b', 1, 'sha')) is None
+    cache.set(('a/b', 1, 'sha'), ['file1', 'file2'])
+    assert cache.get(('a/b', 1, 'sha')) == ['file1', 'file2']
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_least_recently_used_entries_are_evicted(make_cache, mocker):
+    """
+    Test that the least recently used entries are evicted when the cache is full.
+    """
+    mocked_time = mocker.patch('pr_watcher_notifier.cache.time.time', return_value=100)
+    cache = make_cache(max_entries=2)
+    cache.set('a', [1])
+    mocked_time.return_value = 101
+    cache.set('b', [2])
+    mocked_time.return_value = 102
+    cache.get('a')
+    mocked_time.return_value = 103
+    cache.set('c', [3])
+    assert cache.get('b') is None
+    assert cache.get('a') == [1]
+    assert cache.get('c') == [3]
+
+
+def test_expired_entries_are_ignored(make_cache, mocker):
+    """
+    Test that the entries older than the TTL are not returned.
+    """
+    mocked_time = mocker.patch('pr_watcher_notifier.cache.time.time', return_value=100)
+    cache = make_cache(ttl=10)
+    cache.set('a', [1])
+    mocked_time.return_value = 111
+    assert cache.get('a') is None
+
+
+def test_memory_cache_is_bounded_in_bytes():
+    """
+    Test that the least recently used entries are evicted when the values exceed the byte budget.
+    """
+    cache = MemoryCache(max_bytes=20)
+    cache.set('a', 'x' * 8)
+    cache.set('b', 'y' * 8)
+    cache.set('c', 'z' * 8)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'y' * 8
+    cache.set('d', 'w' * 30)
+    assert cache.get('d') is None
+    assert cache.size == 20
+
+
+def test_sqlite_cache_is_shared(tmp_path):
+    """
+    Test that separate SQLite caches using the same database share the entries of a namespace.
+    """
+    path = str(tmp_path / 'cache.sqlite3')
+    SQLiteCache(path, 'pr_files').set('a', [1])
+    assert SQLiteCache(path, 'pr_files').get('a') == [1]
+    assert SQLiteCache(path, 'comparisons').get('a') is None
+
+
+def test_get_cache_uses_the_configured_backend(app, client, tmp_path):  # pylint: disable=unused-argument
+    """
+    Test that the caches are created once with the configured backend.
+    """
+    app.config['GITHUB_CACHE_BACKEND'] = 'sqlite'
+    app.config['GITHUB_CACHE_PATH'] = str(tmp_path / 'cache.sqlite3')
+    cache = get_cache('pr_files')
+    assert isinstance(cache, SQLiteCache)
+    assert get_cache('pr_files') is cache
+    cache.get('missing')
+    assert get_cache_stats() == {'pr_files': {'hits': 0, 'misses': 1}}
@@ -0,0 +1,84 @@
+"""
+Unit tests for the conditional GitHub API requests.
+"""
+import json
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .cache import MemoryCache
+from .conditional_requests import ConditionalAdapter
+from .github_api import get_client
+
+
+def make_raw_response(request, status, headers, body=''):
+    """
+    Make a response as returned by the network for the given request.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body.encode('utf-8')  # pylint: disable=protected-access
+    response._content_consumed = True  # pylint: disable=protected-access
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def test_unchanged_responses_are_revalidated(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that a repeated call is sent with the ETag and answered from the cache on a 304.
+    """
+    repo = {'full_name': 'a/b', 'name': 'b', 'url': 'https://api.github.com/repos/a/b'}
+    sent = []
+
+    def send(request, **kwargs):  # pylint: disable=unused-argument
+        sent.append(dict(request.headers))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return make_raw_response(
+                request, 304, {'ETag': '"v1"', 'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '4998'}
+            )
+        return make_raw_response(
+            request, 200, {'ETag': '"v1"', 'X-RateLimit-Remaining': '4999', 'Content-Type': 'application/json'},
+            json.dumps(repo),
+        )
+
+    mocker.patch('requests.adapters.HTTPAdapter.send', side_effect=send)
+    github = get_client()
+    assert github.get_repo('a/b').full_name == 'a/b'
+    assert github.get_repo('a/b').full_name == 'a/b'
+    assert 'If-None-Match' not in sent[0]
+    assert sent[1]['If-None-Match'] == '"v1"'
+    assert github.requester.rate_limiting[0] == 4998
+
+
+def test_responses_vary_with_the_credentials(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the responses cached for a token aren't revalidated with another token.
+    """
+    mocked_send = mocker.patch(
+        'requests.adapters.HTTPAdapter.send',
+        side_effect=lambda request, **kwargs: make_raw_response(request, 200, {'ETag': '"v1"'}, '{"name": "b"}'),
+    )
+    get_client().get_repo('a/b')
+    app.config['GITHUB_ACCESS_TOKEN'] = 'another'
+    get_client().get_repo('a/b')
+    assert 'If-None-Match' not in mocked_send.call_args.args[0].headers
+
+
+def test_large_responses_are_not_cached(app, mocker):
+    """
+    Test that the responses larger than the limit aren't kept in the cache.
+    """
+    mocker.patch('pr_watcher_notifier.conditional_requests.MAX_BODY_SIZE', 10)
+    mocker.patch(
+        'requests.adapters.HTTPAdapter.send',
+        side_effect=lambda request, **kwargs: make_raw_response(request, 200, {'ETag': '"v1"'}, f'"{"x" * 100}"'),
+    )
+    cache = MemoryCache()
+    adapter = ConditionalAdapter(cache)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    with app.app_context():
+        session.get('https://api.github.com/repos/a/b')
+    assert not cache.entries
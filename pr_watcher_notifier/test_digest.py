@@ -0,0 +1,93 @@
+"""
+Unit tests for the digest emails.
+"""
+import json
+from pathlib import Path
+
+import pytest
+from jinja2 import TemplateSyntaxError
+
+from .digest import Digest, SQLiteDigestStore, get_digest, get_digest_settings
+from .notification import make_notification_context, send_notifications
+from .watch_config import WatchConfigIndex
+
+TEST_DATA = Path(__file__).parent.parent / "test_data"
+
+
+def make_data(number, config):
+    """
+    Return the combined data of a matching event.
+    """
+    with open(TEST_DATA / "pr_145_merged.json", encoding="utf-8") as fdata:
+        data = json.load(fdata)
+    data['number'] = number
+    data['watch_config'] = config
+    data['modified_files'] = [f'oeps/oep-{number}.rst']
+    return data
+
+
+def test_events_are_coalesced_per_recipient_list(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the events of a digest window are sent in a single email per recipient list.
+    """
+    mocked_mailer = mocker.patch('pr_watcher_notifier.digest.get_mailer')
+    config = {
+        'patterns': ['oeps/*'], 'recipients': ['a@example.com'], 'subject': 'Change', 'digest': {'window': 60},
+    }
+    other_config = dict(config, recipients=['b@example.com'])
+    send_notifications(make_data(1, config))
+    send_notifications(make_data(2, config))
+    send_notifications(make_data(3, other_config))
+
+    get_digest().flush()
+    mocked_mailer.return_value.send.assert_not_called()
+
+    get_digest().flush(force=True)
+    emails = {tuple(call.args[0].recipients): call.args[0] for call in mocked_mailer.return_value.send.call_args_list}
+    assert set(emails) == {('a@example.com',), ('b@example.com',)}
+    assert emails[('a@example.com',)].subject == 'PR Watcher notifier: 2 watched changes'
+    assert 'oeps/oep-1.rst' in emails[('a@example.com',)].body
+    assert 'oeps/oep-2.rst' in emails[('a@example.com',)].body
+    assert 'oeps/oep-3.rst' not in emails[('a@example.com',)].body
+
+
+def test_events_are_sent_when_the_window_ends(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that a digest is sent once its window ended.
+    """
+    mocked_mailer = mocker.patch('pr_watcher_notifier.digest.get_mailer')
+    mocked_time = mocker.patch('pr_watcher_notifier.digest.time.time', return_value=1000)
+    config = {'patterns': ['oeps/*'], 'recipients': 'a@example.com', 'subject': 'Change', 'digest': True}
+    send_notifications(make_data(1, config))
+    mocked_time.return_value = 1000 + 3600
+    get_digest().flush()
+    mocked_mailer.return_value.send.assert_called_once()
+
+
+def test_shared_digests_are_sent_once(app, client, mocker, tmp_path):  # pylint: disable=unused-argument
+    """
+    Test that the events added by several processes to the SQLite store are sent in a single digest.
+    """
+    mocked_mailer = mocker.patch('pr_watcher_notifier.digest.get_mailer')
+    config = {'patterns': ['oeps/*'], 'recipients': ['a@example.com'], 'subject': 'Change', 'digest': True}
+    workers = [Digest(app, SQLiteDigestStore(str(tmp_path / 'digest.sqlite3'))) for _ in range(2)]
+    for number, worker in enumerate(workers):
+        worker.add(make_notification_context(make_data(number, config)), *get_digest_settings(config))
+
+    for worker in workers:
+        worker.flush(force=True)
+    mocked_mailer.return_value.send.assert_called_once()
+    email = mocked_mailer.return_value.send.call_args.args[0]
+    assert email.subject == 'PR Watcher notifier: 2 watched changes'
+    assert 'oeps/oep-0.rst' in email.body and 'oeps/oep-1.rst' in email.body
+
+
+def test_digest_templates_are_compiled_with_the_watch_config(app):
+    """
+    Test that the errors in the digest templates are raised when the watch configuration is loaded.
+    """
+    index = WatchConfigIndex({
+        'a/b': {'patterns': ['*'], 'recipients': 'a@example.com', 'subject': 'Change', 'digest': {'subject': '{{ x'}},
+    })
+    with pytest.raises(TemplateSyntaxError):
+        index.compile_templates(app.jinja_env)
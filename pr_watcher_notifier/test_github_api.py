@@ -0,0 +1,231 @@
+"""
+Unit tests for the GitHub API utilities.
+"""
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from github import RateLimitExceededException
+from github.PullRequest import PullRequest
+
+from benchmarks.stubs import StubGitHub
+
+from . import create_app
+from .conftest import get_dummy_pr_with_list_of_files
+from .github_api import (
+    ClientPool, RateLimited, get_client, get_client_pool, get_comparison_file_names, get_pr, get_pr_file_names,
+    get_target_branch, iter_open_prs
+)
+
+TEST_DATA = Path(__file__).parent.parent / 'test_data'
+
+
+def test_client_is_shared(app, client):  # pylint: disable=unused-argument
+    """
+    Test that the same client is reused across calls and threads.
+    """
+    def get_client_in_context():
+        with app.app_context():
+            return get_client()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        clients = list(executor.map(lambda _: get_client_in_context(), range(8)))
+    assert all(c is get_client() for c in clients)
+
+
+def test_client_is_recreated_when_settings_change(app, client):  # pylint: disable=unused-argument
+    """
+    Test that changing the client settings results in a new client.
+    """
+    first = get_client()
+    app.config['GITHUB_POOL_SIZE'] = 2
+    assert get_client() is not first
+
+
+def test_clients_are_not_shared_between_apps(app, client):  # pylint: disable=unused-argument
+    """
+    Test that each app has its own clients, which use the caches of the app.
+    """
+    first = get_client()
+    with create_app('test_settings').app_context():
+        assert get_client() is not first
+
+
+def test_client_connections_are_kept_alive(app, client):  # pylint: disable=unused-argument
+    """
+    Test that the calls of a client reuse the same connection to the GitHub API.
+    """
+    github = StubGitHub()
+    try:
+        app.config.update(GITHUB_BASE_URL=github.url, GITHUB_RETRIES=0, GITHUB_SECONDS_BETWEEN_REQUESTS=0)
+        for _ in range(5):
+            get_client().get_repo('a/b')
+        assert github.calls['repo'] == 5
+        assert github.connections == 1
+    finally:
+        github.shutdown()
+
+
+def test_get_pr_from_webhook_payload(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the pull request is built from the webhook payload without retrieving it.
+    """
+    with open(TEST_DATA / 'pr_145_merged.json', encoding='utf-8') as fdata:
+        data = json.load(fdata)
+    mocked_get_repo = mocker.patch('github.MainClass.Github.get_repo')
+    mocked_request = mocker.patch('github.Requester.Requester.requestJsonAndCheck', return_value=({}, []))
+    pr = get_pr(data['repository']['full_name'], data['number'], data['pull_request'])
+    assert get_target_branch(pr) == 'master'
+    assert not list(pr.get_files())
+    mocked_get_repo.assert_not_called()
+    assert mocked_request.call_args.args[:2] == (
+        'GET', 'https://api.github.com/repos/openedx/open-edx-proposals/pulls/145/files'
+    )
+
+
+def test_pr_file_names_are_cached_by_head_commit(app, client):  # pylint: disable=unused-argument
+    """
+    Test that the files of a pull request are only retrieved once for a given head commit.
+    """
+    pr = get_dummy_pr_with_list_of_files(['documents/file1.rst'])
+    pr.number = 1
+    assert get_pr_file_names('a/b', pr, 'sha1') == ['documents/file1.rst']
+    assert get_pr_file_names('a/b', pr, 'sha1') == ['documents/file1.rst']
+    pr.get_files.assert_called_once()
+    get_pr_file_names('a/b', pr, 'sha2')
+    assert pr.get_files.call_count == 2
+
+
+def make_client(remaining, resettime):
+    """
+    Create a fake client whose last response reported the given rate limit.
+    """
+    client = MagicMock()
+    client.requester.rate_limiting = (remaining, 5000)
+    client.requester.rate_limiting_resettime = resettime
+    return client
+
+
+def test_client_pool_spreads_calls_across_tokens():
+    """
+    Test that the client with the most remaining requests is used, and that unknown rate limits are tried first.
+    """
+    reset = time.time() + 600
+    busy, idle = make_client(200, reset), make_client(3000, reset)
+    assert ClientPool([busy, idle]).acquire() is idle
+    fresh = make_client(-1, 0)
+    assert ClientPool([busy, fresh, idle]).acquire() is fresh
+    assert ClientPool([make_client(0, time.time() - 1)]).acquire() is not None
+
+
+def test_client_pool_raises_when_rate_limited():
+    """
+    Test that running out of requests on all the tokens results in `RateLimited` with the earliest reset.
+    """
+    now = time.time()
+    pool = ClientPool([make_client(50, now + 600), make_client(10, now + 300)], reserve=100)
+    with pytest.raises(RateLimited) as exc_info:
+        pool.acquire()
+    assert 290 < exc_info.value.retry_after <= 300
+
+
+def test_pool_is_built_from_all_the_tokens(app, client):  # pylint: disable=unused-argument
+    """
+    Test that a client is created for each distinct configured token.
+    """
+    app.config['GITHUB_ACCESS_TOKENS'] = ['123', '456']
+    assert len(get_client_pool().clients) == 2
+
+
+def test_rate_limit_errors_are_raised(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that a comparison failing on the rate limit raises `RateLimited` instead of returning no files.
+    """
+    mocker.patch(
+        'github.MainClass.Github.get_repo',
+        side_effect=RateLimitExceededException(403, {}, {'Retry-After': '42'}),
+    )
+    with pytest.raises(RateLimited) as exc_info:
+        get_comparison_file_names('a/b', 'main', 'sha1')
+    assert exc_info.value.retry_after == 42
+
+
+def make_files_page(paths, cursor=None):
+    """
+    Make a GraphQL response with a page of the files of a pull request.
+    """
+    return {}, {'data': {'repository': {'pullRequest': {
+        'baseRefName': 'main',
+        'files': {
+            'nodes': [{'path': path} for path in paths],
+            'pageInfo': {'hasNextPage': bool(cursor), 'endCursor': cursor},
+        },
+    }}}}
+
+
+def test_graphql_backend_retrieves_the_files_page_by_page(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the pull request and its first page of files are retrieved with one query, and the other pages on demand.
+    """
+    app.config['GITHUB_API_BACKEND'] = 'graphql'
+    mocked_query = mocker.patch(
+        'github.Requester.Requester.graphql_query',
+        side_effect=[make_files_page(['docs/a.rst'], 'cursor1'), make_files_page(['docs/b.rst'])],
+    )
+    pr = get_pr('a/b', 1)
+    assert get_target_branch(pr) == 'main'
+    assert mocked_query.call_count == 1
+    assert get_pr_file_names('a/b', pr, 'sha1') == ['docs/a.rst', 'docs/b.rst']
+    assert mocked_query.call_args.args[1] == {'owner': 'a', 'name': 'b', 'number': 1, 'cursor': 'cursor1'}
+
+
+def test_graphql_backend_uses_the_webhook_payload(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the base branch comes from the webhook payload, and that only the files are queried.
+    """
+    app.config['GITHUB_API_BACKEND'] = 'graphql'
+    mocked_query = mocker.patch('github.Requester.Requester.graphql_query', return_value=make_files_page(['x.py']))
+    pr = get_pr('a/b', 1, {'number': 1, 'base': {'ref': 'release'}})
+    assert get_target_branch(pr) == 'release'
+    mocked_query.assert_not_called()
+    assert get_pr_file_names('a/b', pr) == ['x.py']
+    assert mocked_query.call_args.args[1]['cursor'] is None
+
+
+def test_pygithub_is_imported_on_first_use():
+    """
+    Test that creating the app doesn't import PyGithub, whose import slows down starting the workers.
+    """
+    code = (
+        "import sys; from pr_watcher_notifier import create_app; create_app('test_settings'); "
+        "assert 'github' not in sys.modules, 'PyGithub was imported'"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=Path(__file__).parent.parent)
+
+
+def test_app_requires_github_credentials():
+    """
+    Test that the app doesn't start without any GitHub credentials, instead of failing on each webhook.
+    """
+    settings = type('Settings', (), {'GITHUB_WEBHOOK_SECRET': 'abc', 'WATCH_CONFIG': {}})
+    with pytest.raises(ValueError, match='No GitHub credentials'):
+        create_app(settings)
+
+
+def test_open_prs_are_listed_without_retrieving_them(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the listed pull requests aren't retrieved one by one.
+    """
+    requester = MagicMock()
+    pr_data = {'number': 1, 'merged_at': None, 'url': 'https://api.github.com/repos/a/b/pulls/1'}
+    get_client = mocker.patch('pr_watcher_notifier.github_api.get_client')
+    get_client.return_value.get_repo.return_value.get_pulls.return_value = [
+        PullRequest(requester, {}, pr_data, completed=False),
+    ]
+    assert list(iter_open_prs('a/b')) == [{**pr_data, 'merged': False}]
+    requester.requestJsonAndCheck.assert_not_called()
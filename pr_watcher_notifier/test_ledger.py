@@ -0,0 +1,78 @@
+"""
+Unit tests for the notification ledger.
+"""
+import pytest
+
+from .ledger import MemoryLedger, SQLiteLedger
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def ledger(request, tmp_path):
+    """
+    Fixture that returns both types of ledgers.
+    """
+    if request.param == 'sqlite':
+        return SQLiteLedger(str(tmp_path / 'ledger.sqlite3'))
+    return MemoryLedger()
+
+
+def test_notifications_are_recorded_per_pr_and_patterns(ledger):
+    """
+    Test that the notifications are recorded for the PR and the set of patterns.
+    """
+    assert not ledger.was_notified('a/b', 1, ['documents/*'])
+    ledger.record_notification('a/b', 1, ['documents/*', '*.rst'])
+    assert ledger.was_notified('a/b', 1, ['*.rst', 'documents/*'])
+    assert not ledger.was_notified('a/b', 1, ['documents/*'])
+    assert not ledger.was_notified('a/b', 2, ['documents/*', '*.rst'])
+
+
+def test_sqlite_ledger_is_persistent(tmp_path):
+    """
+    Test that the SQLite ledger keeps the notifications across instances.
+    """
+    SQLiteLedger(str(tmp_path / 'ledger.sqlite3')).record_notification('a/b', 1, ['documents/*'])
+    assert SQLiteLedger(str(tmp_path / 'ledger.sqlite3')).was_notified('a/b', 1, ['documents/*'])
+
+
+def test_deliveries_and_events_are_recorded(ledger):
+    """
+    Test that the processed deliveries and events are recorded.
+    """
+    assert not ledger.has_delivery('abc')
+    ledger.record_delivery('abc')
+    assert ledger.has_delivery('abc')
+    assert not ledger.has_event('["a/b", 1, "opened"]')
+    ledger.record_event('["a/b", 1, "opened"]')
+    assert ledger.has_event('["a/b", 1, "opened"]')
+
+
+def test_old_entries_are_compacted(ledger, mocker):
+    """
+    Test that the entries older than the retention period are ignored and dropped by the compaction.
+    """
+    mocked_time = mocker.patch('pr_watcher_notifier.ledger.time.time', return_value=1000)
+    ledger.retention = 100
+    ledger.compaction_interval = 50
+    ledger.record_delivery('old')
+    mocked_time.return_value = 1060
+    ledger.record_delivery('new')
+    mocked_time.return_value = 1110
+    assert not ledger.has_delivery('old')
+    assert ledger.has_delivery('new')
+    ledger.compact()
+    mocked_time.return_value = 1000
+    assert not ledger.has_delivery('old')
+
+
+def test_memory_ledger_is_bounded():
+    """
+    Test that the memory ledger drops the oldest entries beyond its maximum size.
+    """
+    ledger = MemoryLedger(max_entries=2)
+    ledger.record_delivery('a')
+    ledger.record_delivery('b')
+    ledger.record_delivery('a')
+    ledger.record_delivery('c')
+    assert ledger.has_delivery('a') and ledger.has_delivery('c')
+    assert not ledger.has_delivery('b')
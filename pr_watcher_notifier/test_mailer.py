@@ -0,0 +1,59 @@
+"""
+Unit tests for sending emails.
+"""
+import smtplib
+import time
+
+from flask_mail import Message
+
+from .mailer import MailQueue, PersistentConnection
+
+
+def make_message(n=1):
+    """
+    Return a dummy message.
+    """
+    return Message(f'Subject {n}', recipients=['nobody@example.com'], body='Body', sender='sender@example.com')
+
+
+def test_connection_is_reused(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the SMTP connection is only opened once for several emails.
+    """
+    mocked_configure_host = mocker.patch('flask_mail.Connection.configure_host')
+    app.extensions['mail'].suppress = False
+    connection = PersistentConnection(app.extensions['mail'])
+    for n in range(3):
+        connection.send(make_message(n))
+    mocked_configure_host.assert_called_once()
+    assert mocked_configure_host.return_value.sendmail.call_count == 3
+
+
+def test_reconnects_when_disconnected(app, client, mocker):  # pylint: disable=unused-argument
+    """
+    Test that the connection is reopened and the email sent again when the server dropped the connection.
+    """
+    first_host, second_host = mocker.MagicMock(), mocker.MagicMock()
+    first_host.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+    mocked_configure_host = mocker.patch('flask_mail.Connection.configure_host', side_effect=[first_host, second_host])
+    app.extensions['mail'].suppress = False
+    PersistentConnection(app.extensions['mail']).send(make_message())
+    assert mocked_configure_host.call_count == 2
+    second_host.sendmail.assert_called_once()
+
+
+def test_queue_sends_in_batches(app, mocker):
+    """
+    Test that the queued emails are sent in a batch once the batch size is reached.
+    """
+    connection = mocker.MagicMock()
+    connection.send.side_effect = [None, smtplib.SMTPRecipientsRefused({}), None]
+    mail_queue = MailQueue(app, connection, batch_size=3, flush_interval=60)
+    for n in range(3):
+        mail_queue.put(make_message(n))
+    deadline = time.monotonic() + 5
+    while mail_queue.stats['batches'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert connection.send.call_count == 3
+    assert mail_queue.stats['sent'] == 2
+    assert mail_queue.stats['failed'] == 1
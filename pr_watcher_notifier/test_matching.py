@@ -0,0 +1,37 @@
+"""
+Unit tests for the file pattern matcher.
+"""
+from fnmatch import fnmatch
+
+from .matching import FileMatcher
+
+PATTERNS = ['docs/*', '*.rst', 'common/lib/mylibrary/__init__.py']
+FILE_NAMES = [
+    'docs/index.rst', 'src/module.py', 'README.rst', 'common/lib/mylibrary/__init__.py', 'docs/conf.py', 'docs',
+]
+
+
+def test_matches_like_nested_fnmatch_loop():
+    """
+    Test that the matcher keeps the order and the duplicates of the nested fnmatch loop.
+    """
+    expected = [name for name in FILE_NAMES for pattern in PATTERNS if fnmatch(name, pattern)]
+    assert list(FileMatcher(PATTERNS).iter_matches(FILE_NAMES)) == expected
+    assert expected.count('docs/index.rst') == 2
+
+
+def test_no_patterns():
+    """
+    Test that a matcher without any pattern never matches.
+    """
+    assert not list(FileMatcher([]).iter_matches(FILE_NAMES))
+
+
+def test_first_match_stops_consuming():
+    """
+    Test that looking for the first match doesn't consume the rest of the file names.
+    """
+    file_names = iter(FILE_NAMES)
+    assert FileMatcher(PATTERNS).first_match(file_names) == 'docs/index.rst'
+    assert next(file_names) == 'src/module.py'
+    assert not FileMatcher(PATTERNS).any_match(['src/module.py'])
@@ -0,0 +1,87 @@
+"""
+Unit tests for the metrics.
+"""
+import json
+import subprocess
+import sys
+
+from .metrics import Registry, render
+
+
+def test_render_counters_gauges_and_histograms():
+    """
+    Test the Prometheus text format of the metrics of a process.
+    """
+    registry = Registry()
+    registry.inc('pr_watcher_rejections_total', {'reason': 'ignored_action'})
+    registry.inc('pr_watcher_rejections_total', {'reason': 'ignored_action'})
+    registry.set('pr_watcher_github_rate_limit_remaining', 4999)
+    registry.observe('pr_watcher_stage_seconds', 0.02, {'stage': 'json_parse'})
+    registry.observe('pr_watcher_stage_seconds', 3.0, {'stage': 'json_parse'})
+    output = render(registry.collect())
+    assert '# TYPE pr_watcher_rejections_total counter' in output
+    assert 'pr_watcher_rejections_total{reason="ignored_action"} 2' in output
+    assert 'pr_watcher_github_rate_limit_remaining 4999' in output
+    assert 'pr_watcher_stage_seconds_bucket{stage="json_parse",le="0.01"} 0' in output
+    assert 'pr_watcher_stage_seconds_bucket{stage="json_parse",le="0.025"} 1' in output
+    assert 'pr_watcher_stage_seconds_bucket{stage="json_parse",le="+Inf"} 2' in output
+    assert 'pr_watcher_stage_seconds_count{stage="json_parse"} 2' in output
+    assert 'pr_watcher_stage_seconds_sum{stage="json_parse"} 3.02' in output
+
+
+def test_processes_are_merged(tmp_path):
+    """
+    Test that the snapshots written by the other processes to the metrics directory are added up.
+    """
+    other = Registry()
+    other.inc('pr_watcher_emails_total', {'result': 'sent'}, 2)
+    other.set('pr_watcher_github_rate_limit_remaining', 10)
+    (tmp_path / 'metrics-1.json').write_text(json.dumps(other.snapshot()), encoding='utf-8')
+    registry = Registry()
+    registry.configure(str(tmp_path))
+    registry.inc('pr_watcher_emails_total', {'result': 'sent'}, 3)
+    registry.set('pr_watcher_github_rate_limit_remaining', 20)
+    output = render(registry.collect())
+    assert 'pr_watcher_emails_total{result="sent"} 5' in output
+    assert 'pr_watcher_github_rate_limit_remaining 20' in output
+
+
+def test_metrics_endpoint(client, post, app):
+    """
+    Test that the endpoint exposes the rejected webhooks and requires the token when one is set.
+    """
+    post({'action': 'labeled'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    assert 'pr_watcher_rejections_total{reason="ignored_action"}' in response.get_data(as_text=True)
+
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_snapshots_of_the_dead_processes_are_archived(tmp_path):
+    """
+    Test that the counters of the processes which exited are kept, without their gauges and files.
+    """
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], check=True,
+                          capture_output=True, text=True)
+    other = Registry()
+    other.inc('pr_watcher_emails_total', {'result': 'sent'}, 2)
+    other.set('pr_watcher_work_queue_depth', 3, {'pid': dead.stdout.strip()})
+    (tmp_path / f'metrics-{dead.stdout.strip()}.json').write_text(json.dumps(other.snapshot()), encoding='utf-8')
+    registry = Registry()
+    registry.configure(str(tmp_path))
+    registry.inc('pr_watcher_emails_total', {'result': 'sent'}, 3)
+    output = render(registry.collect())
+    assert 'pr_watcher_emails_total{result="sent"} 5' in output
+    assert 'pr_watcher_work_queue_depth' not in output
+    assert not (tmp_path / f'metrics-{dead.stdout.strip()}.json').exists()
+
+    registry.close()
+    assert sorted(path.name for path in tmp_path.glob('metrics-*.json')) == ['metrics-archive.json']
+    collector = Registry()
+    collector.configure(str(tmp_path))
+    assert 'pr_watcher_emails_total{result="sent"} 5' in render(collector.collect())
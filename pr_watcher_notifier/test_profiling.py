@@ -0,0 +1,64 @@
+"""
+Unit tests for the profiling of the webhooks.
+"""
+import hashlib
+import hmac
+import os
+import pstats
+
+from .conftest import get_dummy_pr_with_list_of_files
+from .profiling import rotate_profiles
+
+
+def mock_matching_pull_request(mocker):
+    """
+    Mock a webhook for a pull request with matching files.
+    """
+    mocker.patch(
+        'pr_watcher_notifier.views.get_request_json',
+        return_value={'number': 1, 'repository': {'full_name': 'a/b', 'private': False}, 'action': 'opened'}
+    )
+    mocker.patch('pr_watcher_notifier.views.get_pr', return_value=get_dummy_pr_with_list_of_files(['documents/a']))
+    return mocker.patch('pr_watcher_notifier.views.send_notifications')
+
+
+def test_sampled_webhooks_are_profiled(app, post, mocker, tmp_path):
+    """
+    Test that the processing of the sampled webhooks is written to the profiles directory.
+    """
+    app.config['PROFILE_DIR'] = str(tmp_path)
+    send_notifications = mock_matching_pull_request(mocker)
+    response = post(json={'a': 1})
+    assert response.status_code == 201
+    send_notifications.assert_called_once()
+    profiles = list(tmp_path.glob('profile-*-a_b_1.pstats'))
+    assert len(profiles) == 1
+    functions = {function for _, _, function in pstats.Stats(str(profiles[0])).stats}
+    assert 'combine_data' in functions
+
+
+def test_webhooks_with_a_signed_header_are_profiled(app, post, mocker, tmp_path):
+    """
+    Test that only the webhooks with a valid profiling signature are profiled by default when a secret is set.
+    """
+    app.config.update(PROFILE_DIR=str(tmp_path), PROFILE_SECRET='profile')
+    mock_matching_pull_request(mocker)
+    post(json={'a': 1}, headers={'X-Profile-Signature': 'invalid'})
+    post(json={'a': 1})
+    assert not list(tmp_path.iterdir())
+    body = b'{"a": 1}'
+    signature = hmac.new(b'profile', body, hashlib.sha256).hexdigest()
+    post(json={'a': 1}, headers={'X-Profile-Signature': f'sha256={signature}'})
+    assert len(list(tmp_path.glob('profile-*.pstats'))) == 1
+
+
+def test_oldest_profiles_are_removed(tmp_path):
+    """
+    Test the rotation of the profiles.
+    """
+    for i in range(5):
+        path = tmp_path / f'profile-{i}.pstats'
+        path.write_bytes(b'')
+        os.utime(path, (i, i))
+    rotate_profiles(str(tmp_path), 2)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['profile-3.pstats', 'profile-4.pstats']
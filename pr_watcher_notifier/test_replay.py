@@ -0,0 +1,101 @@
+"""
+Unit tests for the replay command.
+"""
+import json
+
+from .conftest import get_dummy_pr_with_list_of_files
+
+
+def make_payload(repo, action='opened', number=1, head_sha='sha1'):
+    """
+    Make a minimal pull request webhook payload.
+    """
+    return {
+        'action': action,
+        'number': number,
+        'repository': {'full_name': repo, 'private': False},
+        'pull_request': {'number': number, 'head': {'sha': head_sha}, 'base': {'ref': 'main'}},
+    }
+
+
+def write_corpus(path, records):
+    """
+    Write a JSONL corpus.
+    """
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records), encoding='utf-8')
+    return str(path)
+
+
+def test_replay_recorded_corpus(app, tmp_path):
+    """
+    Test that the recorded events are matched against the watch configuration without calling GitHub.
+    """
+    corpus = write_corpus(tmp_path / 'corpus.jsonl', [
+        {'payload': make_payload('a/b'), 'files': ['documents/x.rst', 'src/y.py']},
+        {'payload': make_payload('a/b', number=2), 'files': ['src/y.py']},
+        {'payload': make_payload('b/c'), 'files': ['documents/z.rst']},
+        make_payload('b/d'),
+        make_payload('x/y'),
+        make_payload('a/b', action='labeled'),
+    ])
+    result = app.test_cli_runner().invoke(args=['replay', corpus, '--workers', '2', '--json'])
+    assert result.exit_code == 0, result.output
+    stats = json.loads(result.output)
+    assert stats['events'] == 6
+    assert stats['matched:a/b'] == 2
+    assert stats['notified:a/b'] == 1
+    assert stats['notified:b/*'] == 1
+    assert stats['unrecorded'] == 1
+    assert stats['rejected:unwatched_repo'] == 1
+    assert stats['rejected:ignored_action'] == 1
+    assert stats['emails'] == 2
+    assert stats['api_calls'] == 3
+
+
+def test_replay_synchronize_events_need_the_comparison_files(app, tmp_path, mocker):
+    """
+    Test that the recorded synchronize events without the files of the update aren't evaluated against GitHub.
+    """
+    get_comparison_file_names = mocker.patch('pr_watcher_notifier.views.get_comparison_file_names')
+    payload = make_payload('a/b', action='synchronize')
+    payload['before'] = 'sha0'
+    corpus = write_corpus(tmp_path / 'corpus.jsonl', [
+        {'payload': payload, 'files': ['documents/x.rst']},
+        {'payload': payload, 'files': ['documents/x.rst'], 'comparison_files': ['documents/x.rst']},
+    ])
+    result = app.test_cli_runner().invoke(args=['replay', corpus, '--workers', '1', '--json'])
+    assert result.exit_code == 0, result.output
+    stats = json.loads(result.output)
+    assert stats['unrecorded'] == 1
+    assert stats['matched:a/b'] == 1
+    get_comparison_file_names.assert_not_called()
+
+
+def test_replay_with_another_watch_config(app, tmp_path):
+    """
+    Test evaluating a new watch configuration, with the report format.
+    """
+    config_file = tmp_path / 'config.yml'
+    config_file.write_text(
+        'x/y:\n  patterns: ["src/*"]\n  recipients: ["x@example.com", "y@example.com"]\n  subject: "Change"\n'
+    )
+    corpus = write_corpus(tmp_path / 'corpus.jsonl', [
+        {'payload': make_payload('x/y'), 'files': ['src/y.py']},
+        {'payload': make_payload('a/b'), 'files': ['documents/x.rst']},
+    ])
+    result = app.test_cli_runner().invoke(args=['replay', corpus, '--watch-config', str(config_file)])
+    assert result.exit_code == 0, result.output
+    assert 'x/y' in result.output
+    assert 'Projected emails: 1, to 2 recipients' in result.output
+    assert 'Rejected (unwatched_repo): 1' in result.output
+
+
+def test_replay_with_live_github(app, tmp_path, mocker):
+    """
+    Test that the files are retrieved from GitHub with the live backend.
+    """
+    mocker.patch('pr_watcher_notifier.views.get_pr', return_value=get_dummy_pr_with_list_of_files(['documents/a']))
+    corpus = write_corpus(tmp_path / 'corpus.jsonl', [make_payload('a/b'), make_payload('a/b', number=2)])
+    result = app.test_cli_runner().invoke(args=['replay', corpus, '--github', 'live', '--workers', '2', '--json'])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)['notified:a/b'] == 2
@@ -1,9 +1,18 @@
 """
 Unit tests for the application.
 """
+import hashlib
+import hmac
+import json
 
-from .views import get_repo_watch_config
-from .conftest import get_dummy_pr_with_list_of_files
+import pytest
+
+from . import metrics
+from .github_api import RateLimited
+from .ledger import get_ledger
+from .views import get_repo_watch_config, peek_action
+from .work_queue import QueueFull
+from .conftest import FakeFile, get_dummy_pr_with_list_of_files
 
 URL = '/pull-requests'
 
@@ -110,6 +119,28 @@ def test_notification_not_sent_when_unable_to_retrieve_pr_details(post, mocker):
     assert response.status_code == 200
 
 
+def test_processing_deferred_when_rate_limited(post, mocker):
+    """
+    Test that an event is deferred until the rate limit is reset rather than ignored.
+    """
+    mocker.patch('pr_watcher_notifier.views.get_pr', side_effect=RateLimited(120))
+    mocked_queue = mocker.patch('pr_watcher_notifier.views.get_work_queue')
+    mocked_send_notifications = mocker.patch('pr_watcher_notifier.views.send_notifications')
+    response = post(json={
+        'repository': {
+            'full_name': 'a/b',
+            'private': False,
+        },
+        'number': 1,
+        'action': 'opened',
+    }, headers={'X-GitHub-Delivery': 'rate-limited'})
+    assert response.status_code == 202
+    delay, job, _, delivery_id = mocked_queue.return_value.submit_later.call_args.args
+    assert (delay, job.__name__, delivery_id) == (120, 'process_pull_request', 'rate-limited')
+    mocked_send_notifications.assert_not_called()
+    assert not get_ledger().has_delivery('rate-limited')
+
+
 def test_no_files_matching_condition(post, mocker):
     """
     Test if no files in the opened PR match the watch pattern.
@@ -145,6 +176,22 @@ def test_files_matching_condition(post, mocker):
     mocked_send_notifications.assert_called_once()
 
 
+def test_files_are_matched_with_the_watch_config_entry(app, post, mocker):
+    """
+    Test that the files are matched with the matcher compiled with the watch configuration.
+    """
+    mocker.patch(
+        'pr_watcher_notifier.views.get_request_json',
+        return_value={'number': 1, 'repository': {'full_name': 'a/b', 'private': False}, 'action': 'opened'}
+    )
+    mocker.patch('pr_watcher_notifier.views.get_pr', return_value=get_dummy_pr_with_list_of_files(['documents/a']))
+    mocker.patch('pr_watcher_notifier.views.send_notifications')
+    index = app.config['WATCH_CONFIG_INDEX']
+    iter_matches = mocker.spy(index.get_entry(index.lookup('a/b')[0]).matcher, 'iter_matches')
+    assert post(json={'a': 1}).status_code == 201
+    iter_matches.assert_called_once()
+
+
 def test_pr_synchronized_but_already_notified(post, mocker):
     """
     Test when the files in the synchronized PR match the watch pattern,
@@ -359,3 +406,231 @@ def test_notifications_sent_for_private_repo_with_matching_org_wildcard_pattern_
     response = post(json={'a': 1})
     assert response.status_code == 201
     mocked_send_notifications.assert_called_once()
+
+
+def test_async_processing_enqueues_and_accepts(app, post, mocker):
+    """
+    Test that in asynchronous mode the event is enqueued and accepted without being processed.
+    """
+    app.config['ASYNC_PROCESSING'] = True
+    mocked_queue = mocker.patch('pr_watcher_notifier.views.get_work_queue')
+    mocked_combine_data = mocker.patch('pr_watcher_notifier.views.combine_data')
+    response = post(json={'number': 1, 'repository': {'full_name': 'a/b', 'private': False}, 'action': 'opened'})
+    assert response.status_code == 202
+    mocked_queue.return_value.submit.assert_called_once()
+    mocked_combine_data.assert_not_called()
+
+
+def test_async_processing_when_queue_is_full(app, post, mocker):
+    """
+    Test that in asynchronous mode a full queue results in a retryable error.
+    """
+    app.config['ASYNC_PROCESSING'] = True
+    mocked_queue = mocker.patch('pr_watcher_notifier.views.get_work_queue')
+    mocked_queue.return_value.submit.side_effect = QueueFull('full')
+    response = post(json={'number': 1, 'repository': {'full_name': 'a/b', 'private': False}, 'action': 'opened'})
+    assert response.status_code == 503
+
+
+def test_pr_synchronized_and_already_notified_stops_retrieving_files(post, mocker):
+    """
+    Test that the remaining files of the PR aren't retrieved once the notification is known to be a duplicate.
+    """
+    mocker.patch(
+        'pr_watcher_notifier.views.get_request_json',
+        return_value={
+            'number': 1,
+            'repository': {'full_name': 'a/b', 'private': False},
+            'action': 'synchronize', 'before': '123'
+        }
+    )
+    retrieved = []
+
+    def get_files():
+        for name in ['documents/file1.rst', 'documents/file2.rst', 'elsewhere/file3.py']:
+            retrieved.append(name)
+            yield FakeFile(name)
+
+    dummy_pr_object = get_dummy_pr_with_list_of_files([])
+    dummy_pr_object.get_files.side_effect = get_files
+    mocker.patch('pr_watcher_notifier.views.get_pr', return_value=dummy_pr_object)
+    mocker.patch('pr_watcher_notifier.views.get_target_branch', return_value='master')
+    mocker.patch('pr_watcher_notifier.views.get_comparison_file_names', return_value=['documents/file1.rst'])
+    mocked_send_notifications = mocker.patch('pr_watcher_notifier.views.send_notifications')
+    response = post(json={'a': 1})
+    assert response.status_code == 200
+    mocked_send_notifications.assert_not_called()
+    assert retrieved == ['documents/file1.rst']
+
+
+@pytest.mark.parametrize('scenario', [
+    (True, ['documents/file1.rst'], False),
+    (False, ['documents/file1.rst'], True),
+    (False, ['elsewhere/file2.py'], False),
+])
+def test_pr_synchronized_with_incremental_strategy(app, post, mocker, scenario):
+    """
+    Test the incremental de-duplication of the notifications of synchronized PRs.
+    """
+    already_recorded, pushed_file_names, notified = scenario
+    app.config['SYNCHRONIZE_STRATEGY'] = 'incremental'
+    mocker.patch(
+        'pr_watcher_notifier.views.get_request_json',
+        return_value={
+            'number': 1,
+            'repository': {'full_name': 'a/b', 'private': False},
+            'action': 'synchronize', 'before': '123', 'after': '456',
+        }
+    )
+    if already_recorded:
+        get_ledger().record_notification('a/b', 1, ['documents/*'])
+    dummy_pr_object = get_dummy_pr_with_list_of_files(["documents/file1.rst", "elsewhere/file2.py"])
+    mocker.patch('pr_watcher_notifier.views.get_pr', return_value=dummy_pr_object)
+    mocked_comparison = mocker.patch(
+        'pr_watcher_notifier.views.get_comparison_file_names', return_value=pushed_file_names
+    )
+    mocked_send_notifications = mocker.patch('pr_watcher_notifier.views.send_notifications')
+    response = post(json={'a': 1})
+    assert response.status_code == (201 if notified else 200)
+    assert mocked_send_notifications.called == notified
+    if not already_recorded:
+        mocked_comparison.assert_called_once_with('a/b', '123', '456')
+    assert get_ledger().was_notified('a/b', 1, ['documents/*']) == (already_recorded or notified)
+
+
+def test_redelivery_is_skipped_before_any_github_api_call(post, mocker):
+    """
+    Test that a redelivered webhook is ignored without retrieving the PR.
+    """
+    mocker.patch(
+        'pr_watcher_notifier.views.get_request_json',
+        return_value={'number': 1, 'repository': {'full_name': 'a/b', 'private': False}, 'action': 'opened'}
+    )
+    dummy_pr_object = get_dummy_pr_with_list_of_files(["documents/file1.rst"])
+    mocked_get_pr = mocker.patch('pr_watcher_notifier.views.get_pr', return_value=dummy_pr_object)
+    mocked_send_notifications = mocker.patch('pr_watcher_notifier.views.send_notifications')
+    assert post(json={'a': 1}, headers={'X-GitHub-Delivery': 'delivery-1'}).status_code == 201
+    assert post(json={'a': 1}, headers={'X-GitHub-Delivery': 'delivery-1'}).status_code == 200
+    mocked_get_pr.assert_called_once()
+    mocked_send_notifications.assert_called_once()
+
+
+def test_same_event_from_another_webhook_is_skipped(post, mocker):
+    """
+    Test that the same event delivered by another webhook is ignored without retrieving the PR.
+    """
+    payload = {
+        'number': 1,
+        'repository': {'full_name': 'a/b', 'private': False},
+        'action': 'opened',
+        'pull_request': {'head': {'sha': 'abc'}, 'updated_at': '2020-04-06T00:00:00Z'},
+    }
+    mocker.patch('pr_watcher_notifier.views.get_request_json', side_effect=lambda _: dict(payload))
+    dummy_pr_object = get_dummy_pr_with_list_of_files(["documents/file1.rst"])
+    mocked_get_pr = mocker.patch('pr_watcher_notifier.views.get_pr', return_value=dummy_pr_object)
+    mocked_send_notifications = mocker.patch('pr_watcher_notifier.views.send_notifications')
+    assert post(json={'a': 1}, headers={'X-GitHub-Delivery': 'delivery-1'}).status_code == 201
+    assert post(json={'a': 1}, headers={'X-GitHub-Delivery': 'delivery-2'}).status_code == 200
+    mocked_get_pr.assert_called_once()
+    mocked_send_notifications.assert_called_once()
+
+
+def test_peek_action():
+    """
+    Test reading the action from the start of the body without parsing it.
+    """
+    assert peek_action(b'{"action":"labeled","number":1}') == 'labeled'
+    assert peek_action(b'{\n  "action": "opened",\n  "number": 1\n}') == 'opened'
+    assert peek_action(b'{"number":1,"action":"opened"}') is None
+    assert peek_action(b'{"pull_request":{"action":"opened"}}') is None
+
+
+def get_rejection_counts():
+    """
+    Return the number of webhooks rejected by the pre-filtering in this process, by reason.
+    """
+    return {
+        dict(labels)['reason']: value
+        for labels, value in metrics.REGISTRY.get_counter_values('pr_watcher_rejections_total').items()
+    }
+
+
+def test_ignored_action_is_rejected_before_parsing(post, mocker):
+    """
+    Test that an action which can't notify is rejected without parsing the body or looking up the delivery.
+    """
+    mocked_get_request_json = mocker.patch('pr_watcher_notifier.views.get_request_json')
+    mocked_get_pr = mocker.patch('pr_watcher_notifier.views.get_pr')
+    mocked_get_ledger = mocker.patch('pr_watcher_notifier.views.get_ledger')
+    response = post(
+        json={'action': 'labeled', 'number': 1, 'repository': {'full_name': 'a/b'}},
+        headers={'X-GitHub-Delivery': 'delivery1'},
+    )
+    assert response.status_code == 200
+    mocked_get_request_json.assert_not_called()
+    mocked_get_pr.assert_not_called()
+    mocked_get_ledger.assert_not_called()
+    assert get_rejection_counts()['ignored_action'] >= 1
+
+
+def test_unwatched_repo_is_rejected_before_any_github_api_call(post, mocker):
+    """
+    Test that an event for a repository without a watch configuration is rejected without retrieving the PR.
+    """
+    mocked_get_pr = mocker.patch('pr_watcher_notifier.views.get_pr')
+    before = get_rejection_counts().get('unwatched_repo', 0)
+    response = post(json={'action': 'opened', 'number': 1, 'repository': {'full_name': 'x/y', 'private': False}})
+    assert response.status_code == 200
+    mocked_get_pr.assert_not_called()
+    assert get_rejection_counts()['unwatched_repo'] == before + 1
+
+
+def sign(body, algorithm):
+    """
+    Return the signature of a webhook body with the test secret.
+    """
+    return f'{algorithm}=' + hmac.new(b'abc', body, getattr(hashlib, algorithm)).hexdigest()
+
+
+@pytest.mark.parametrize('header, algorithm, status_code', [
+    ('X-Hub-Signature-256', 'sha256', 200),
+    ('X-Hub-Signature', 'sha1', 200),
+    ('X-Hub-Signature-256', 'sha1', 400),
+])
+def test_signature_is_checked_on_the_raw_body(client, header, algorithm, status_code):
+    """
+    Test that the SHA-256 signature is checked, falling back to the SHA-1 one.
+    """
+    body = json.dumps({'action': 'opened', 'number': 1, 'repository': {'full_name': 'x/y', 'private': False}})
+    response = client.post(
+        URL,
+        data=body,
+        content_type='application/json',
+        headers={'X-Github-Event': 'pull_request', header: sign(body.encode(), algorithm)},
+    )
+    assert response.status_code == status_code
+
+
+def test_sha256_signature_takes_precedence(client):
+    """
+    Test that a valid SHA-1 signature doesn't make up for an invalid SHA-256 one.
+    """
+    body = b'{"action": "opened"}'
+    response = client.post(URL, data=body, content_type='application/json', headers={
+        'X-Github-Event': 'pull_request', 'X-Hub-Signature-256': 'sha256=0', 'X-Hub-Signature': sign(body, 'sha1'),
+    })
+    assert response.status_code == 400
+
+
+def test_too_large_body_is_rejected_before_any_work(app, client, mocker):
+    """
+    Test that a body above the size limit is rejected before checking the signature.
+    """
+    app.config['MAX_CONTENT_LENGTH'] = 10
+    mocked_is_signature_valid = mocker.patch('pr_watcher_notifier.views.is_signature_valid')
+    response = client.post(
+        URL, data=b'{"action": "opened"}', content_type='application/json', headers={'X-Github-Event': 'pull_request'}
+    )
+    assert response.status_code == 413
+    mocked_is_signature_valid.assert_not_called()
+    assert get_rejection_counts()['too_large'] >= 1
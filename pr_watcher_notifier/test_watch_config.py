@@ -0,0 +1,192 @@
+"""
+Unit tests for the watch configuration index.
+"""
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+
+import pytest
+from jinja2 import TemplateSyntaxError
+
+from . import watch_config as watch_config_module
+from .watch_config import (
+    DuplicateKeyWarning, WatchConfigIndex, WatchConfigReloader, load_watch_config, validate_watch_config
+)
+
+
+def linear_lookup(watch_config, repo):
+    """
+    The original linear fnmatch scan, used as the reference implementation.
+    """
+    repo_config = {}
+    wildcard_match = False
+    for watched_repo_name, config in watch_config.items():
+        if fnmatch(repo, watched_repo_name):
+            if any(fnmatch(repo, exclude) for exclude in config.get('exclude', ())):
+                continue
+            repo_config = config
+            if '/*' not in watched_repo_name:
+                wildcard_match = False
+                break
+            wildcard_match = True
+    return repo_config, wildcard_match
+
+
+WATCH_CONFIG = {
+    'a/*': {'patterns': ['docs/*'], 'recipients': ['org-a@example.com'], 'exclude': ['a/*scratch*']},
+    'a/special': {'patterns': ['docs/*'], 'recipients': ['special@example.com']},
+    'a/*-docs': {'patterns': ['*'], 'recipients': ['docs@example.com']},
+    'b/repo-?': {'patterns': ['*'], 'recipients': ['b@example.com']},
+    'b/repo-1': {'patterns': ['*'], 'recipients': ['b1@example.com']},
+    '*/shared': {'patterns': ['*'], 'recipients': ['shared@example.com']},
+    'c/excluded': {'patterns': ['*'], 'recipients': ['c@example.com'], 'exclude': ['c/*']},
+    'c/*': {'patterns': ['*'], 'recipients': ['c-org@example.com']},
+}
+
+
+@pytest.mark.parametrize('repo', [
+    'a/anything', 'a/special', 'a/my-scratch-repo', 'a/user-docs', 'a/shared',
+    'b/repo-1', 'b/repo-2', 'b/other', 'x/shared', 'c/excluded', 'c/other', 'd/nothing', 'noslash',
+])
+def test_index_matches_linear_lookup(repo):
+    """
+    Test that the index returns the same result as the original linear scan.
+    """
+    assert WatchConfigIndex(WATCH_CONFIG).lookup(repo) == linear_lookup(WATCH_CONFIG, repo)
+
+
+def test_index_places_keys_in_the_right_buckets():
+    """
+    Test that only the irregular globs end up being matched with regexes.
+    """
+    index = WatchConfigIndex(WATCH_CONFIG)
+    assert set(index.exact) == {'a/special', 'b/repo-1', 'c/excluded'}
+    assert set(index.orgs) == {'a', 'c'}
+    assert [entry.key for _, entry in index.globs] == ['a/*-docs', 'b/repo-?', '*/shared']
+
+
+def test_empty_watch_config():
+    """
+    Test looking up a repository when nothing is configured.
+    """
+    assert WatchConfigIndex(None).lookup('a/b') == ({}, False)
+
+
+def test_templates_are_compiled_once(app):
+    """
+    Test that the templates of the indexed configurations are compiled when asked to.
+    """
+    index = WatchConfigIndex({'a/b': {'patterns': ['*'], 'recipients': [], 'subject': 'Change in {{ repo }}'}})
+    index.compile_templates(app.jinja_env)
+    entry = index.get_entry(index.lookup('a/b')[0])
+    assert entry.subject_template.render(repo='a/<b>') == 'Change in a/<b>'
+    assert entry.body_template.name == 'email_body.txt'
+    assert index.get_entry({'patterns': ['*']}) is None
+
+
+def test_template_errors_are_raised_when_compiling(app):
+    """
+    Test that the template syntax errors are raised when compiling rather than when sending.
+    """
+    index = WatchConfigIndex({'a/b': {'patterns': ['*'], 'recipients': [], 'subject': 'Change in {{ repo '}})
+    with pytest.raises(TemplateSyntaxError):
+        index.compile_templates(app.jinja_env)
+
+
+VALID_CONFIG = """
+a/b:
+  patterns: ["docs/*"]
+  recipients: ["nobody@example.com"]
+  subject: "Change in {{ repo }}"
+"""
+
+
+def write_config(path, content, mtime_ns):
+    """
+    Write a watch configuration file with the given modification time.
+    """
+    path.write_text(content, encoding='utf-8')
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_reloader_swaps_in_a_valid_config(app, tmp_path):
+    """
+    Test that a modified valid configuration replaces the current one.
+    """
+    config_file = tmp_path / 'config.yml'
+    write_config(config_file, VALID_CONFIG, 1_000_000_000)
+    reloader = WatchConfigReloader(app, str(config_file), 1)
+    assert not reloader.check()
+    write_config(config_file, VALID_CONFIG.replace('a/b', 'c/d'), 2_000_000_000)
+    assert reloader.check()
+    assert app.config['WATCH_CONFIG_INDEX'].lookup('c/d')[0]['subject'] == 'Change in {{ repo }}'
+    assert not app.config['WATCH_CONFIG_INDEX'].lookup('a/b')[0]
+
+
+@pytest.mark.parametrize('content', [
+    'a/b: [',
+    'a/b:\n  patterns: "docs/*"\n  recipients: ["nobody@example.com"]\n  subject: "Change"\n',
+    VALID_CONFIG.replace('{{ repo }}', '{{ repo '),
+])
+def test_reloader_keeps_the_last_good_config(app, tmp_path, content):
+    """
+    Test that an invalid configuration is not used.
+    """
+    index = app.config['WATCH_CONFIG_INDEX']
+    config_file = tmp_path / 'config.yml'
+    write_config(config_file, VALID_CONFIG, 1_000_000_000)
+    reloader = WatchConfigReloader(app, str(config_file), 1)
+    write_config(config_file, content, 2_000_000_000)
+    assert not reloader.check()
+    assert app.config['WATCH_CONFIG_INDEX'] is index
+
+
+def test_validate_watch_config():
+    """
+    Test that the sample configuration is valid and that a configuration without patterns is not.
+    """
+    validate_watch_config(load_watch_config(Path(__file__).parent.parent / 'watch_config.yml.sample'))
+    with pytest.raises(ValueError, match='patterns'):
+        validate_watch_config({'a/b': {'recipients': 'nobody@example.com', 'subject': 'Change'}})
+
+
+def test_duplicate_keys_are_reported(tmp_path):
+    """
+    Test that a warning is shown for the keys overwriting a previous one.
+    """
+    config_file = tmp_path / 'config.yml'
+    config_file.write_text(VALID_CONFIG + VALID_CONFIG.replace('docs/*', 'other/*'), encoding='utf-8')
+    with pytest.warns(DuplicateKeyWarning, match="'a/b' on line 7"):
+        watch_config = load_watch_config(config_file)
+    assert watch_config['a/b']['patterns'] == ['other/*']
+
+
+def test_snapshot_is_used_for_the_same_file(tmp_path, mocker):
+    """
+    Test that the snapshot of a configuration file is loaded instead of parsing the file again.
+    """
+    config_file = tmp_path / 'config.yml'
+    config_file.write_text(VALID_CONFIG, encoding='utf-8')
+    snapshot_dir = tmp_path / 'snapshots'
+    spied_parse = mocker.spy(watch_config_module, 'parse_watch_config')
+    watch_config = load_watch_config(config_file, snapshot_dir)
+    assert load_watch_config(config_file, snapshot_dir) == watch_config
+    assert spied_parse.call_count == 1
+
+    config_file.write_text(VALID_CONFIG.replace('a/b', 'c/d'), encoding='utf-8')
+    assert 'c/d' in load_watch_config(config_file, snapshot_dir)
+    assert spied_parse.call_count == 2
+    assert len(list(snapshot_dir.iterdir())) == 2
+
+
+def test_snapshot_is_optional(tmp_path):
+    """
+    Test that the configuration is loaded with a warning when the snapshot can't be written.
+    """
+    config_file = tmp_path / 'config.yml'
+    config_file.write_text(VALID_CONFIG, encoding='utf-8')
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_text('', encoding='utf-8')
+    with pytest.warns(UserWarning, match='Unable to write the watch configuration snapshot'):
+        watch_config = load_watch_config(config_file, not_a_dir / 'snapshots')
+    assert 'a/b' in watch_config
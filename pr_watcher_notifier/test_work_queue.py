@@ -0,0 +1,69 @@
+"""
+Unit tests for the background work queue.
+"""
+import threading
+
+import pytest
+from flask import current_app
+
+from .work_queue import QueueFull, WorkQueue
+
+
+def test_jobs_run_in_app_context(app):
+    """
+    Test that the submitted jobs are run by the workers inside an application context.
+    """
+    results = []
+    work_queue = WorkQueue(app, workers=2, max_depth=10)
+    for i in range(5):
+        work_queue.submit(lambda n: results.append((n, current_app.name)), i)
+    work_queue.shutdown(timeout=5)
+    assert sorted(results) == [(i, app.name) for i in range(5)]
+
+
+def test_failing_job_does_not_stop_the_worker(app):
+    """
+    Test that a job raising an exception doesn't kill its worker thread.
+    """
+    results = []
+    work_queue = WorkQueue(app, workers=1, max_depth=10)
+    work_queue.submit(lambda: 1 / 0)
+    work_queue.submit(results.append, 'done')
+    work_queue.shutdown(timeout=5)
+    assert results == ['done']
+
+
+def test_backpressure_when_full(app):
+    """
+    Test that submitting to a full queue fails immediately instead of blocking.
+    """
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_job():
+        started.set()
+        release.wait(5)
+
+    work_queue = WorkQueue(app, workers=1, max_depth=1)
+    work_queue.submit(blocking_job)
+    started.wait(5)
+    work_queue.submit(blocking_job)
+    with pytest.raises(QueueFull):
+        work_queue.submit(blocking_job)
+    release.set()
+    work_queue.shutdown(timeout=5)
+    with pytest.raises(QueueFull):
+        work_queue.submit(blocking_job)
+
+
+def test_deferred_jobs_are_submitted_later(app):
+    """
+    Test that a deferred job runs after its delay, and that the pending deferred jobs are bounded.
+    """
+    done = threading.Event()
+    work_queue = WorkQueue(app, workers=1, max_depth=1)
+    work_queue.submit_later(0.05, done.set)
+    with pytest.raises(QueueFull):
+        work_queue.submit_later(0.05, done.set)
+    assert done.wait(5)
+    work_queue.shutdown(timeout=5)
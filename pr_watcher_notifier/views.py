@@ -1,22 +1,79 @@
 """
 views for the application.
 """
-
-from fnmatch import fnmatch
+import hmac
+import json
+import logging
+import re
 
 from flask import abort, request, current_app, Blueprint
 
-from .github_api import get_comparison_file_names, get_target_branch, get_pr, is_signature_valid
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import metrics
+from .github_api import (
+    RateLimited, get_comparison_file_names, get_pr, get_target_branch, is_signature_valid, iter_pr_file_names
+)
+from .ledger import get_ledger, patterns_key
 from .notification import send_notifications
+from .profiling import profiled, should_profile
+from .watch_config import WatchedRepoEntry, get_watch_config_index, start_watch_config_reloader
+from .work_queue import QueueFull, get_work_queue
 
 APP = Blueprint('views', __name__, template_folder='templates')
 
+# The pull request actions which can result in a notification.
+NOTIFY_ACTIONS = frozenset(('opened', 'closed', 'synchronize', 'reopened'))
+
+# GitHub sends the action as the first key of the payload, which lets most of the events be
+# rejected without parsing the whole body.
+LEADING_ACTION_RE = re.compile(rb'\s*\{\s*"action"\s*:\s*"([a-z_]+)"')
+
+
+def count_rejection(reason):
+    """
+    Count a webhook rejected by the pre-filtering, by reason.
+    """
+    metrics.inc('pr_watcher_rejections_total', {'reason': reason})
+
+
+def peek_action(body):
+    """
+    Return the action of a pull request payload if it is the first key of the body, without parsing it, else None.
+    """
+    match = LEADING_ACTION_RE.match(body)
+    return match.group(1).decode() if match else None
+
+
+def get_rejection_reason(data):
+    """
+    Return why the pull request event can't result in a notification, or None if it may.
+
+    This only uses the payload and the watch configuration, without any GitHub API call.
+    """
+    if data['action'] not in NOTIFY_ACTIONS:
+        return 'ignored_action'
+    repo_config, _ = get_repo_watch_config(current_app.config['WATCH_CONFIG_INDEX'], data['repository']['full_name'])
+    if not repo_config:
+        return 'unwatched_repo'
+    return None
+
 
 def get_request_json(req):
     """
     Return the parsed request body JSON.
+
+    The body read for the signature check is parsed, with orjson when it is installed.
     """
-    data = req.get_json(silent=True)
+    data = None
+    if req.is_json:
+        try:
+            data = orjson.loads(req.get_data()) if orjson is not None else json.loads(req.get_data())
+        except ValueError:
+            pass
     if data is None:
         current_app.logger.error('Invalid JSON in the request body')
         abort(400)
@@ -26,38 +83,53 @@ def get_request_json(req):
 def get_repo_watch_config(watch_config, repo):
     """
     Return the watch configuration for a given repository.
+
+    The watch configuration can either be the raw configuration dict or a prebuilt `WatchConfigIndex`.
     """
-    repo_config = {}
-    wildcard_match = False
-    for watched_repo_name, config in watch_config.items():
-        if fnmatch(repo, watched_repo_name):
-            excludes = config.get("exclude", ())
-            if any(fnmatch(repo, exclude) for exclude in excludes):
-                continue
-            repo_config = config
-            if '/*' not in watched_repo_name:
-                wildcard_match = False
-                break
-            wildcard_match = True
-    return repo_config, wildcard_match
+    with metrics.timed('config_lookup'):
+        return get_watch_config_index(watch_config).lookup(repo)
 
 
-def should_send_notification(data):
+def is_already_notified(data, pr, matcher):
+    """
+    Return whether the watched files of a synchronized PR were already notified before the update.
+
+    With the default `base` strategy, the previous HEAD of the PR branch is compared against the target
+    branch, and the notification was already sent if files matching the patterns were modified.
+
+    With the `incremental` strategy, the notification ledger is checked first. If no notification was
+    recorded for the PR and the patterns, only the files changed by the update are compared, and the
+    notification is only sent if files matching the patterns were modified by the update.
+    """
+    repo = data['repository']['full_name']
+    if current_app.config.get('SYNCHRONIZE_STRATEGY', 'base') == 'incremental':
+        if get_ledger().was_notified(repo, data['number'], matcher.patterns):
+            return True
+        return not matcher.any_match(get_comparison_file_names(repo, data['before'], data['after']))
+    target = get_target_branch(pr)
+    previous_head = data['before']
+    return matcher.any_match(get_comparison_file_names(repo, target, previous_head))
+
+
+def should_send_notification(data, matcher):
     """
     Return whether the notification should be sent for the given request data or not.
+
+    The files are matched with the `FileMatcher` of the watch configuration entry of the repository.
     """
     action = data['action']
     notify = False
     matching_modified_files = []
-    if action in ('opened', 'closed', 'synchronize', 'reopened'):  # pylint:disable=too-many-nested-blocks
+    if action in NOTIFY_ACTIONS:
         repo = data['repository']['full_name']
         is_private = data['repository']['private']
         pr_number = data['number']
         try:
-            pr = get_pr(repo, pr_number)
+            pr = get_pr(repo, pr_number, data.get('pull_request'))
+        except RateLimited:
+            raise
         except Exception:
             return notify, matching_modified_files
-        matched = False
         config = data['watch_config']
         wildcard_match = data['wildcard_match']
         if is_private and wildcard_match and not config.get('notify_for_private_repos', False):
@@ -66,38 +138,103 @@ def should_send_notification(data):
             )
             return False, []
         if config:
-            for modified_file in pr.get_files():
-                for pattern in config['patterns']:
-                    current_app.logger.debug(f"fnmatch({modified_file.filename!r}, {pattern!r})")
-                    if fnmatch(modified_file.filename, pattern):
-                        matched = True
-                        matching_modified_files.append(modified_file.filename)
-        if matched:
-            notify = True
-
-            # To avoid duplicate notifications for the same PR when its source branch is updated,
-            # check if the modifications to the watched patterns are first added by the changes
-            # in the update. This can be done by comparing the previous HEAD of the PR branch against
-            # the target branch and verifying that no files matching the patterns were modified.
-            if action == 'synchronize':
-                target = get_target_branch(pr)
-                previous_head = data['before']
-                for modified_file in get_comparison_file_names(repo, target, previous_head):
-                    for pattern in config['patterns']:
-                        if fnmatch(modified_file, pattern):
-                            notify = False
-                            break
+            head_sha = data.get('pull_request', {}).get('head', {}).get('sha')
+            # The files are matched as they are retrieved, page by page. Only the first match is
+            # needed to decide whether to notify, the rest is only retrieved for the email.
+            matches = matcher.iter_matches(iter_pr_file_names(repo, pr, head_sha))
+            first_match = next(matches, None)
+            if first_match is not None:
+                notify = True
+                matching_modified_files = [first_match]
+
+                if action == 'synchronize' and is_already_notified(data, pr, matcher):
+                    notify = False
+                if notify:
+                    matching_modified_files.extend(matches)
+            if current_app.logger.isEnabledFor(logging.DEBUG):
+                current_app.logger.debug(f'Files matching {matcher.patterns!r}: {matching_modified_files!r}')
     return notify, matching_modified_files
 
 
 def combine_data(data, watch_config):
+    index = get_watch_config_index(watch_config)
     repo = data['repository']['full_name']
-    data['watch_config'], data['wildcard_match'] = get_repo_watch_config(watch_config, repo)
-    notify, modified_files = should_send_notification(data)
+    data['watch_config'], data['wildcard_match'] = get_repo_watch_config(index, repo)
+    entry = index.get_entry(data['watch_config'])
+    if entry is None:
+        # The configurations which aren't part of the index are compiled on demand.
+        entry = WatchedRepoEntry(0, '', data['watch_config'])
+    notify, modified_files = should_send_notification(data, entry.matcher)
     data['notify'] = notify
     data['modified_files'] = modified_files
 
 
+def get_event_key(data, repo_config):
+    """
+    Return the key identifying a pull request event for the watched patterns, or None if it can't be identified.
+
+    Redeliveries and the same event delivered by several webhooks, e.g. a repository and an organization
+    webhook, have the same key.
+    """
+    pr_data = data.get('pull_request') or {}
+    head_sha = pr_data.get('head', {}).get('sha')
+    if not head_sha or not repo_config:
+        return None
+    return json.dumps([
+        data['repository']['full_name'],
+        data['number'],
+        data['action'],
+        head_sha,
+        pr_data.get('updated_at'),
+        patterns_key(repo_config['patterns']),
+    ])
+
+
+def process_pull_request(data, delivery_id=None, profile=False):
+    """
+    Match the pull request event against the watch configuration and send the notifications.
+
+    Events which were already processed are skipped. Return whether a notification was sent, or None
+    if the event was deferred to the work queue until the GitHub API rate limit is reset. When `profile`
+    is true, the matching and the notifications are profiled.
+    """
+    ledger = get_ledger()
+    watch_config = current_app.config['WATCH_CONFIG_INDEX']
+    repo = data['repository']['full_name']
+    pr_number = data['number']
+    event_key = get_event_key(data, get_repo_watch_config(watch_config, repo)[0])
+    if event_key is not None and ledger.has_event(event_key):
+        current_app.logger.info(f'Ignored: {repo} #{pr_number} {data["action"]} was already processed')
+        return False
+    with profiled(f'{repo}#{pr_number}', profile):
+        try:
+            combine_data(data, watch_config)
+        except RateLimited as exc:
+            current_app.logger.warning(f'Deferred: {repo} #{pr_number} for {exc.retry_after:.0f}s, {exc}')
+            get_work_queue().submit_later(exc.retry_after, process_pull_request, data, delivery_id)
+            return None
+        notified = data['notify']
+        if notified:
+            current_app.logger.info(f'Match: {repo} #{pr_number}')
+            send_notifications(data)
+            ledger.record_notification(repo, pr_number, data['watch_config']['patterns'])
+        else:
+            current_app.logger.info(f'Ignored: {repo} #{pr_number}')
+    if event_key is not None:
+        ledger.record_event(event_key)
+    if delivery_id:
+        ledger.record_delivery(delivery_id)
+    return notified
+
+
+@APP.before_app_request
+def start_background_tasks():
+    """
+    Start the background tasks of the worker process handling the request, if they aren't running yet.
+    """
+    start_watch_config_reloader()
+
+
 @APP.route('/pull-requests', methods=['POST', ])
 def handler():
     """
@@ -105,24 +242,68 @@ def handler():
     """
     event_type = request.headers.get('X-Github-Event')
     status_code = 200
+    max_content_length = request.max_content_length
+    if max_content_length is not None and (request.content_length or 0) > max_content_length:
+        current_app.logger.error(f'Request body of {request.content_length} bytes is too large')
+        count_rejection('too_large')
+        abort(413)
     if event_type is None:
         current_app.logger.error('No event type specified')
+        count_rejection('no_event_type')
         abort(400)
     if event_type == 'pull_request':
-        if not is_signature_valid(request):
+        with metrics.timed('signature_check'):
+            signature_valid = is_signature_valid(request)
+        if not signature_valid:
             current_app.logger.error('Invalid request signature')
+            count_rejection('invalid_signature')
             abort(400)
-        data = get_request_json(request)
-        combine_data(data, current_app.config['WATCH_CONFIG'])
-        repo = data['repository']['full_name']
-        pr_number = data['number']
-        if data['notify']:
-            current_app.logger.info(f'Match: {repo} #{pr_number}')
-            send_notifications(data)
-            status_code = 201
-        else:
-            current_app.logger.info(f'Ignored: {repo} #{pr_number}')
+        action = peek_action(request.get_data())
+        if action is not None and action not in NOTIFY_ACTIONS:
+            current_app.logger.info(f'Ignored: {action} action')
+            count_rejection('ignored_action')
+            return '', status_code
+        delivery_id = request.headers.get('X-GitHub-Delivery')
+        if delivery_id and get_ledger().has_delivery(delivery_id):
+            current_app.logger.info(f'Ignored: delivery {delivery_id} was already processed')
+            count_rejection('duplicate_delivery')
+            return '', status_code
+        with metrics.timed('json_parse'):
+            data = get_request_json(request)
+        reason = get_rejection_reason(data)
+        if reason is not None:
+            current_app.logger.info(f'Ignored: {data["repository"]["full_name"]} #{data.get("number")} ({reason})')
+            count_rejection(reason)
+            return '', status_code
+        profile = should_profile(request)
+        try:
+            if current_app.config.get('ASYNC_PROCESSING', False):
+                get_work_queue().submit(process_pull_request, data, delivery_id, profile)
+                status_code = 202
+            else:
+                notified = process_pull_request(data, delivery_id, profile)
+                if notified is None:
+                    status_code = 202
+                elif notified:
+                    status_code = 201
+        except QueueFull as exc:
+            current_app.logger.warning(f'Rejected: {exc}')
+            return '', 503, {'Retry-After': '30'}
     else:
         current_app.logger.info('Ignored: Not a pull request')
+        count_rejection('not_pull_request')
 
     return '', status_code
+
+
+@APP.route('/metrics', methods=['GET', ])
+def metrics_view():
+    """
+    View exposing the metrics of all the processes in the Prometheus text format.
+
+    When `METRICS_TOKEN` is set, the requests must use it as a bearer token.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return metrics.render(metrics.REGISTRY.collect()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
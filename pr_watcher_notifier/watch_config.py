@@ -0,0 +1,379 @@
+"""
+Loading, validation and indexing of the watch configuration for fast repository lookups.
+"""
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+import warnings
+from fnmatch import translate
+
+import yaml
+from flask import current_app
+
+from .matching import FileMatcher, compile_globs, is_glob
+
+DEFAULT_BODY_TEMPLATE = 'email_body.txt'
+DEFAULT_DIGEST_WINDOW = 3600
+DEFAULT_DIGEST_SUBJECT = 'PR Watcher notifier: {{ events|length }} watched changes'
+DEFAULT_DIGEST_BODY_TEMPLATE = 'digest_body.txt'
+
+
+def get_subject_template_source(subject):
+    """
+    Return the Jinja source of a subject template.
+
+    Jinja assumes HTML output, but subjects are plain text, so the html autoescaping is disabled.
+    """
+    return f"{{% autoescape false %}}{subject}{{% endautoescape %}}"
+
+
+def get_digest_settings(config):
+    """
+    Return the window, subject and body template of the digest of a repository configuration.
+    """
+    digest = config['digest']
+    if not isinstance(digest, dict):
+        digest = {}
+    return (
+        digest.get('window', DEFAULT_DIGEST_WINDOW),
+        digest.get('subject', DEFAULT_DIGEST_SUBJECT),
+        digest.get('body', DEFAULT_DIGEST_BODY_TEMPLATE),
+    )
+
+
+class WatchedRepoEntry:
+    """
+    A single entry of the watch configuration along with the data derived from it.
+    """
+    def __init__(self, position, key, config):
+        self.position = position
+        self.key = key
+        self.config = config
+        # Keys containing '/*' are treated as organization wildcards, exactly like the
+        # original linear scan did.
+        self.is_wildcard = '/*' in key
+        self.excludes = compile_globs(config.get('exclude', ()))
+        self.matcher = FileMatcher(config.get('patterns', ()))
+        self.subject_template = None
+        self.body_template = None
+        self.digest_subject_template = None
+        self.digest_body_template = None
+
+    def compile_templates(self, jinja_env):
+        """
+        Compile the subject and body templates of the entry, and those of its digest, with the given Jinja environment.
+        """
+        if 'subject' in self.config:
+            self.subject_template = jinja_env.from_string(get_subject_template_source(self.config['subject']))
+        self.body_template = jinja_env.get_template(self.config.get('body', DEFAULT_BODY_TEMPLATE))
+        if self.config.get('digest'):
+            _, subject, body = get_digest_settings(self.config)
+            self.digest_subject_template = jinja_env.from_string(get_subject_template_source(subject))
+            self.digest_body_template = jinja_env.get_template(body)
+
+    def is_excluded(self, repo):
+        """
+        Return whether the given repository is excluded from this entry.
+        """
+        return self.excludes is not None and self.excludes.match(repo) is not None
+
+
+class WatchConfigIndex:
+    """
+    An index over the watch configuration, built once when the configuration is loaded.
+
+    Exact ``owner/repo`` keys are stored in a dict, ``org/*`` keys in a map keyed by the
+    organization name and only the remaining, irregular, globs are matched with
+    precompiled regexes.
+    """
+    def __init__(self, watch_config):
+        self.watch_config = watch_config
+        self.exact = {}
+        self.orgs = {}
+        self.globs = []
+        self.entries = []
+        self.entries_by_config = {}
+        for position, (key, config) in enumerate((watch_config or {}).items()):
+            entry = WatchedRepoEntry(position, key, config)
+            self.entries.append(entry)
+            self.entries_by_config.setdefault(id(config), []).append(entry)
+            org, _, name = key.partition('/')
+            if not is_glob(key):
+                self.exact[key] = entry
+            elif name == '*' and not is_glob(org):
+                self.orgs[org] = entry
+            else:
+                self.globs.append((re.compile(translate(key)), entry))
+
+    def compile_templates(self, jinja_env):
+        """
+        Compile the templates of all the entries, raising the template errors right away.
+        """
+        for entry in self.entries:
+            entry.compile_templates(jinja_env)
+
+    def get_entry(self, config):
+        """
+        Return the entry for a repository configuration returned by `lookup`, or None if it isn't indexed.
+        """
+        for entry in self.entries_by_config.get(id(config), ()):
+            if entry.config is config:
+                return entry
+        return None
+
+    def candidates(self, repo):
+        """
+        Yield the entries whose key matches the given repository, in no particular order.
+        """
+        entry = self.exact.get(repo)
+        if entry is not None:
+            yield entry
+        org, separator, _ = repo.partition('/')
+        if separator:
+            entry = self.orgs.get(org)
+            if entry is not None:
+                yield entry
+        for regex, entry in self.globs:
+            if regex.match(repo):
+                yield entry
+
+    def lookup(self, repo):
+        """
+        Return the watch configuration for a given repository and whether it was matched by a wildcard.
+
+        The first matching non-wildcard entry in configuration order wins. Otherwise, the last matching
+        wildcard entry is used. Entries excluding the repository are skipped.
+        """
+        specific = None
+        wildcard = None
+        for entry in self.candidates(repo):
+            if entry.is_excluded(repo):
+                continue
+            if entry.is_wildcard:
+                if wildcard is None or entry.position > wildcard.position:
+                    wildcard = entry
+            elif specific is None or entry.position < specific.position:
+                specific = entry
+        if specific is not None:
+            return specific.config, False
+        if wildcard is not None:
+            return wildcard.config, True
+        return {}, False
+
+
+def get_watch_config_index(watch_config):
+    """
+    Return an index for the given watch configuration, building one if needed.
+    """
+    if isinstance(watch_config, WatchConfigIndex):
+        return watch_config
+    return WatchConfigIndex(watch_config)
+
+
+# Bump when the format of the loaded watch configuration changes, to ignore the older snapshots.
+SNAPSHOT_VERSION = 1
+
+
+class DuplicateKeyWarning(UserWarning):
+    """
+    Warning about a key repeated in a mapping of the watch configuration, which overwrites the previous one.
+    """
+
+
+class WatchConfigLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):  # pylint: disable=too-many-ancestors
+    """
+    A safe YAML loader, using LibYAML when available, which warns about duplicate keys.
+    """
+    def construct_mapping(self, node, deep=False):
+        seen = set()
+        for key_node, _ in node.value:
+            if key_node.tag == 'tag:yaml.org,2002:merge':
+                continue
+            key = self.construct_object(key_node, deep=True)
+            try:
+                duplicate = key in seen
+                seen.add(key)
+            except TypeError:
+                continue
+            if duplicate:
+                warnings.warn(
+                    f'Duplicate key {key!r} on line {key_node.start_mark.line + 1} of the watch configuration '
+                    'overwrites the previous one',
+                    DuplicateKeyWarning,
+                    stacklevel=2,
+                )
+        return super().construct_mapping(node, deep)
+
+
+def parse_watch_config(content):
+    """
+    Parse and validate the YAML content of a watch configuration.
+    """
+    watch_config = yaml.load(content, Loader=WatchConfigLoader)  # nosec: WatchConfigLoader is a safe loader
+    validate_watch_config(watch_config)
+    return watch_config
+
+
+def load_watch_config(config_file, snapshot_dir=None):
+    """
+    Load and validate the watch configuration from the given YAML file.
+
+    When a `snapshot_dir` is given, the validated configuration is stored there in a pickle named
+    after the hash of the file, so that the next processes loading the same file skip parsing it.
+    The snapshot is optional: when it can't be written, a warning is shown and the configuration is
+    still returned.
+    """
+    with open(config_file, 'rb') as yaml_file:
+        content = yaml_file.read()
+    if not snapshot_dir:
+        return parse_watch_config(content)
+    digest = hashlib.sha256(content).hexdigest()
+    snapshot = os.path.join(snapshot_dir, f'watch_config-v{SNAPSHOT_VERSION}-{digest}.pickle')
+    try:
+        with open(snapshot, 'rb') as snapshot_file:
+            return pickle.load(snapshot_file)
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError) as exc:
+        warnings.warn(f'Ignoring the unreadable watch configuration snapshot {snapshot}: {exc}', stacklevel=2)
+    watch_config = parse_watch_config(content)
+    snapshot_file = None
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        # Write to a temporary file first, so that concurrent workers never read a partial snapshot.
+        with tempfile.NamedTemporaryFile('wb', dir=snapshot_dir, delete=False) as snapshot_file:
+            pickle.dump(watch_config, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshot_file.name, snapshot)
+    except OSError as exc:
+        warnings.warn(f'Unable to write the watch configuration snapshot {snapshot}: {exc}', stacklevel=2)
+        if snapshot_file is not None:
+            try:
+                os.remove(snapshot_file.name)
+            except OSError:
+                pass
+    return watch_config
+
+
+def validate_watch_config(watch_config):
+    """
+    Raise a `ValueError` describing the first problem found in the watch configuration, if any.
+    """
+    if not isinstance(watch_config, dict):
+        raise ValueError('The watch configuration must be a mapping of repositories to their configuration')
+    for key, config in watch_config.items():
+        if not isinstance(key, str) or '/' not in key:
+            raise ValueError(f'{key!r} is not a repository name or pattern like "owner/repo" or "org/*"')
+        if not isinstance(config, dict):
+            raise ValueError(f'The configuration of {key!r} must be a mapping')
+        patterns = config.get('patterns')
+        if not isinstance(patterns, list) or not all(isinstance(pattern, str) for pattern in patterns):
+            raise ValueError(f'The patterns of {key!r} must be a list of strings')
+        recipients = config.get('recipients')
+        if not isinstance(recipients, (str, list)) or not recipients:
+            raise ValueError(f'The recipients of {key!r} must be an email address or a list of email addresses')
+        if not isinstance(config.get('subject'), str):
+            raise ValueError(f'The subject of {key!r} must be a string')
+        if not isinstance(config.get('exclude', []), list):
+            raise ValueError(f'The exclude setting of {key!r} must be a list of repository patterns')
+
+
+def build_watch_config_index(watch_config, jinja_env):
+    """
+    Return the index of the watch configuration, with the templates compiled.
+    """
+    index = WatchConfigIndex(watch_config)
+    index.compile_templates(jinja_env)
+    return index
+
+
+class WatchConfigReloader:
+    """
+    Reload the watch configuration of an application when its file is modified.
+
+    A background thread checks the modification time of the file every `interval` seconds. A new
+    configuration is only swapped in once it was parsed, validated and indexed successfully, otherwise
+    the last good configuration stays in use.
+    """
+    def __init__(self, app, config_file, interval, snapshot_dir=None):
+        self.app = app
+        self.config_file = config_file
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.mtime = self.get_mtime()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='pr-watcher-config-reloader', daemon=True)
+
+    def get_mtime(self):
+        """
+        Return the modification time of the configuration file, or None if it can't be read.
+        """
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self):
+        """
+        Reload the configuration if the file was modified, and return whether the new configuration is in use.
+        """
+        mtime = self.get_mtime()
+        if mtime is None or mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        try:
+            with warnings.catch_warnings(record=True) as caught_warnings:
+                warnings.simplefilter('always')
+                watch_config = load_watch_config(self.config_file, self.snapshot_dir)
+            for warning in caught_warnings:
+                self.app.logger.warning(str(warning.message))
+            index = build_watch_config_index(watch_config, self.app.jinja_env)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.app.logger.exception(f'Invalid watch configuration in {self.config_file}, keeping the current one')
+            return False
+        # The handlers only use the index, so replacing it is enough to switch atomically.
+        self.app.config['WATCH_CONFIG'] = watch_config
+        self.app.config['WATCH_CONFIG_INDEX'] = index
+        self.app.logger.info(f'Reloaded the watch configuration from {self.config_file}')
+        return True
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """
+        Start checking the configuration file in the background.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop checking the configuration file.
+        """
+        self.stopped.set()
+
+
+_reloader_lock = threading.Lock()
+
+
+def start_watch_config_reloader():
+    """
+    Start the watch configuration reloader of the current application in the current process, if enabled.
+
+    The reloader is enabled by setting both `WATCH_CONFIG_FILE` and `WATCH_CONFIG_RELOAD_INTERVAL`.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    config_file = app.config.get('WATCH_CONFIG_FILE')
+    interval = app.config.get('WATCH_CONFIG_RELOAD_INTERVAL')
+    if not config_file or not interval:
+        return None
+    with _reloader_lock:
+        reloader, pid = app.extensions.get('pr_watcher_config_reloader', (None, None))
+        if reloader is None or pid != os.getpid():
+            reloader = WatchConfigReloader(app, config_file, interval, app.config.get('WATCH_CONFIG_SNAPSHOT_DIR'))
+            reloader.start()
+            app.extensions['pr_watcher_config_reloader'] = (reloader, os.getpid())
+        return reloader
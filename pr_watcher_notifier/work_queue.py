@@ -0,0 +1,158 @@
+"""
+A bounded in-process work queue for processing webhooks in the background.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from . import metrics
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_DEPTH = 100
+DEFAULT_DRAIN_TIMEOUT = 25
+DEFAULT_REQUEUE_DELAY = 30
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted to a work queue that is full or shutting down.
+    """
+
+
+class WorkQueue:
+    """
+    A pool of worker threads consuming jobs from a bounded queue inside an application context.
+    """
+    def __init__(self, app, workers=DEFAULT_WORKERS, max_depth=DEFAULT_MAX_DEPTH):
+        self.app = app
+        self.queue = queue.Queue(maxsize=max_depth)
+        self.accepting = True
+        self.deferred = set()
+        self.deferred_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, name=f'pr-watcher-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job, *args):
+        """
+        Enqueue a job without blocking, raising `QueueFull` if it cannot be accepted.
+        """
+        if not self.accepting:
+            raise QueueFull('The work queue is shutting down')
+        try:
+            self.queue.put_nowait((job, args))
+        except queue.Full as exc:
+            raise QueueFull(f'The work queue is full ({self.queue.maxsize} jobs)') from exc
+        metrics.set_gauge('pr_watcher_work_queue_depth', self.depth(), {'pid': os.getpid()})
+
+    def submit_later(self, delay, job, *args):
+        """
+        Enqueue a job in `delay` seconds, raising `QueueFull` if it cannot be accepted.
+
+        At most as many jobs as the queue can hold are deferred at the same time.
+        """
+        with self.deferred_lock:
+            if not self.accepting:
+                raise QueueFull('The work queue is shutting down')
+            if len(self.deferred) >= self.queue.maxsize:
+                raise QueueFull(f'Too many deferred jobs ({len(self.deferred)} jobs)')
+            timer = threading.Timer(delay, self._submit_deferred)
+            timer.args = (timer, job, args)
+            timer.daemon = True
+            self.deferred.add(timer)
+        metrics.inc('pr_watcher_deferred_jobs_total')
+        timer.start()
+
+    def _submit_deferred(self, timer, job, args):
+        with self.deferred_lock:
+            self.deferred.discard(timer)
+        try:
+            self.submit(job, *args)
+        except QueueFull as exc:
+            try:
+                self.submit_later(DEFAULT_REQUEUE_DELAY, job, *args)
+            except QueueFull:
+                self.app.logger.error(f'Dropped the deferred job {job.__name__}: {exc}')
+            else:
+                self.app.logger.warning(f'Deferred the job {job.__name__} again: {exc}')
+
+    def depth(self):
+        """
+        Return the approximate number of jobs waiting to be processed.
+        """
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                job, args = item
+                metrics.set_gauge('pr_watcher_work_queue_depth', self.depth(), {'pid': os.getpid()})
+                with self.app.app_context():
+                    try:
+                        job(*args)
+                    except Exception:  # pylint: disable=broad-exception-caught
+                        self.app.logger.exception(f'Background job {job.__name__} failed')
+            finally:
+                self.queue.task_done()
+
+    def shutdown(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        Stop accepting jobs and wait up to `timeout` seconds for the queued ones to be processed.
+        """
+        if not self.accepting:
+            return
+        with self.deferred_lock:
+            self.accepting = False
+            deferred, self.deferred = self.deferred, set()
+        for timer in deferred:
+            timer.cancel()
+        if deferred:
+            self.app.logger.warning(f'Dropped {len(deferred)} deferred jobs')
+        self.app.logger.info(f'Draining {self.depth()} queued jobs')
+        deadline = time.monotonic() + timeout
+        try:
+            for _ in self.threads:
+                # Blocks when the queue is full, until the workers make room for the sentinel.
+                self.queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0))
+        except queue.Full:
+            pass
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        alive = sum(thread.is_alive() for thread in self.threads)
+        if alive:
+            self.app.logger.warning(f'{alive} workers did not finish draining the queue in {timeout}s')
+
+
+_lock = threading.Lock()
+
+
+def get_work_queue():
+    """
+    Return the work queue of the current application, starting it in the current process if needed.
+
+    The queue is created lazily so that each forked gunicorn worker gets its own threads.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    with _lock:
+        work_queue, pid = app.extensions.get('pr_watcher_work_queue', (None, None))
+        if work_queue is None or pid != os.getpid():
+            work_queue = WorkQueue(
+                app,
+                workers=app.config.get('WORK_QUEUE_WORKERS', DEFAULT_WORKERS),
+                max_depth=app.config.get('WORK_QUEUE_MAX_DEPTH', DEFAULT_MAX_DEPTH),
+            )
+            atexit.register(work_queue.shutdown, app.config.get('WORK_QUEUE_DRAIN_TIMEOUT', DEFAULT_DRAIN_TIMEOUT))
+            app.extensions['pr_watcher_work_queue'] = (work_queue, os.getpid())
+        return work_queue
@@ -4,7 +4,7 @@ Configuration for the application.
 
 import os
 
-import yaml
+from pr_watcher_notifier.watch_config import load_watch_config
 
 
 def get_watch_config():
@@ -12,16 +12,101 @@ def get_watch_config():
     Load the watch configuration from the YAML file specified in
     the WATCH_CONFIG_FILE environment variable.
     """
-    config_file = os.environ['WATCH_CONFIG_FILE']
-    with open(config_file, encoding='utf-8') as yaml_file:
-        return yaml.safe_load(yaml_file)
+    return load_watch_config(WATCH_CONFIG_FILE, WATCH_CONFIG_SNAPSHOT_DIR)
 
 
 GITHUB_WEBHOOK_SECRET = os.environ['GITHUB_WEBHOOK_SECRET']
-GITHUB_ACCESS_TOKEN = os.environ['GITHUB_ACCESS_TOKEN']
+# The largest accepted webhook body, GitHub caps the payloads at 25 MB.
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 25 * 1024 * 1024))
+GITHUB_ACCESS_TOKEN = os.environ.get('GITHUB_ACCESS_TOKEN')
 
+# More access tokens, the GitHub API calls are spread across all of them according to their rate limit.
+GITHUB_ACCESS_TOKENS = [
+    token.strip() for token in os.environ.get('GITHUB_ACCESS_TOKENS', '').split(',') if token.strip()
+]
+
+# Authenticate as a GitHub App installation, in addition to or instead of the access tokens.
+GITHUB_APP_ID = os.environ.get('GITHUB_APP_ID')
+if GITHUB_APP_ID:
+    GITHUB_APP_INSTALLATION_ID = os.environ['GITHUB_APP_INSTALLATION_ID']
+    if os.environ.get('GITHUB_APP_PRIVATE_KEY_FILE'):
+        with open(os.environ['GITHUB_APP_PRIVATE_KEY_FILE'], encoding='utf-8') as private_key_file:
+            GITHUB_APP_PRIVATE_KEY = private_key_file.read()
+    else:
+        GITHUB_APP_PRIVATE_KEY = os.environ['GITHUB_APP_PRIVATE_KEY']
+
+if os.environ.get('GITHUB_RATE_LIMIT_RESERVE'):
+    GITHUB_RATE_LIMIT_RESERVE = int(os.environ['GITHUB_RATE_LIMIT_RESERVE'])
+
+if os.environ.get('GITHUB_BASE_URL'):
+    GITHUB_BASE_URL = os.environ['GITHUB_BASE_URL']
+
+if os.environ.get('GITHUB_POOL_SIZE'):
+    GITHUB_POOL_SIZE = int(os.environ['GITHUB_POOL_SIZE'])
+
+if os.environ.get('GITHUB_TIMEOUT'):
+    GITHUB_TIMEOUT = int(os.environ['GITHUB_TIMEOUT'])
+
+if os.environ.get('GITHUB_RETRIES'):
+    GITHUB_RETRIES = int(os.environ['GITHUB_RETRIES'])
+
+if os.environ.get('GITHUB_SECONDS_BETWEEN_REQUESTS'):
+    GITHUB_SECONDS_BETWEEN_REQUESTS = float(os.environ['GITHUB_SECONDS_BETWEEN_REQUESTS'])
+
+if os.environ.get('GITHUB_CACHE_BACKEND'):
+    GITHUB_CACHE_BACKEND = os.environ['GITHUB_CACHE_BACKEND']
+    GITHUB_CACHE_PATH = os.environ.get('GITHUB_CACHE_PATH', 'github_cache.sqlite3')
+
+if os.environ.get('GITHUB_CACHE_MAX_ENTRIES'):
+    GITHUB_CACHE_MAX_ENTRIES = int(os.environ['GITHUB_CACHE_MAX_ENTRIES'])
+
+if os.environ.get('GITHUB_CACHE_MAX_BYTES'):
+    GITHUB_CACHE_MAX_BYTES = int(os.environ['GITHUB_CACHE_MAX_BYTES'])
+
+if os.environ.get('GITHUB_CACHE_TTL'):
+    GITHUB_CACHE_TTL = int(os.environ['GITHUB_CACHE_TTL'])
+
+# Either `rest` or `graphql`, to retrieve the pull requests and their files with the GraphQL API.
+if os.environ.get('GITHUB_API_BACKEND'):
+    GITHUB_API_BACKEND = os.environ['GITHUB_API_BACKEND']
+
+# Revalidate the cached GitHub API responses with their ETag instead of retrieving them again.
+GITHUB_CONDITIONAL_REQUESTS = os.environ.get('GITHUB_CONDITIONAL_REQUESTS', 'true').lower() in ('1', 'true', 'yes')
+
+WATCH_CONFIG_FILE = os.environ['WATCH_CONFIG_FILE']
+# Directory where the parsed watch configuration is cached, to speed up the start of the next processes.
+WATCH_CONFIG_SNAPSHOT_DIR = os.environ.get('WATCH_CONFIG_SNAPSHOT_DIR')
 WATCH_CONFIG = get_watch_config()
 
+# Check the watch configuration file for changes every given number of seconds, and reload it.
+if os.environ.get('WATCH_CONFIG_RELOAD_INTERVAL'):
+    WATCH_CONFIG_RELOAD_INTERVAL = float(os.environ['WATCH_CONFIG_RELOAD_INTERVAL'])
+
+# How to avoid notifying again when the branch of a PR is updated, either "base" or "incremental".
+SYNCHRONIZE_STRATEGY = os.environ.get('SYNCHRONIZE_STRATEGY', 'base')
+
+# The ledger is shared by the worker processes and kept across restarts with the sqlite backend.
+NOTIFICATION_LEDGER_BACKEND = os.environ.get('NOTIFICATION_LEDGER_BACKEND', 'sqlite')
+NOTIFICATION_LEDGER_PATH = os.environ.get('NOTIFICATION_LEDGER_PATH', 'notification_ledger.sqlite3')
+
+if os.environ.get('NOTIFICATION_LEDGER_MAX_ENTRIES'):
+    NOTIFICATION_LEDGER_MAX_ENTRIES = int(os.environ['NOTIFICATION_LEDGER_MAX_ENTRIES'])
+
+if os.environ.get('NOTIFICATION_LEDGER_RETENTION'):
+    NOTIFICATION_LEDGER_RETENTION = int(os.environ['NOTIFICATION_LEDGER_RETENTION'])
+
+# Process the webhooks in background worker threads and respond with 202 right away.
+ASYNC_PROCESSING = os.environ.get('ASYNC_PROCESSING', '').lower() in ('1', 'true', 'yes')
+
+if os.environ.get('WORK_QUEUE_WORKERS'):
+    WORK_QUEUE_WORKERS = int(os.environ['WORK_QUEUE_WORKERS'])
+
+if os.environ.get('WORK_QUEUE_MAX_DEPTH'):
+    WORK_QUEUE_MAX_DEPTH = int(os.environ['WORK_QUEUE_MAX_DEPTH'])
+
+if os.environ.get('WORK_QUEUE_DRAIN_TIMEOUT'):
+    WORK_QUEUE_DRAIN_TIMEOUT = float(os.environ['WORK_QUEUE_DRAIN_TIMEOUT'])
+
 MAIL_DEFAULT_SENDER = os.environ['MAIL_DEFAULT_SENDER']
 
 if os.environ.get('MAIL_SERVER'):
@@ -38,3 +123,34 @@ if os.environ.get('MAIL_USERNAME'):
 
 if os.environ.get('MAIL_PASSWORD'):
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+
+if os.environ.get('MAIL_CONNECTION_MAX_IDLE'):
+    MAIL_CONNECTION_MAX_IDLE = int(os.environ['MAIL_CONNECTION_MAX_IDLE'])
+
+# The pending digests are shared by the worker processes and kept across restarts with the sqlite backend.
+DIGEST_BACKEND = os.environ.get('DIGEST_BACKEND', 'sqlite')
+DIGEST_PATH = os.environ.get('DIGEST_PATH', 'digest.sqlite3')
+
+# Queue the outgoing emails and send them in batches over a single connection.
+MAIL_QUEUE_ENABLED = os.environ.get('MAIL_QUEUE_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+if os.environ.get('MAIL_BATCH_SIZE'):
+    MAIL_BATCH_SIZE = int(os.environ['MAIL_BATCH_SIZE'])
+
+if os.environ.get('MAIL_FLUSH_INTERVAL'):
+    MAIL_FLUSH_INTERVAL = float(os.environ['MAIL_FLUSH_INTERVAL'])
+
+# The directory where the gunicorn workers share their metrics, and the token required to read them.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Profile the processing of the webhooks, sampled at PROFILE_SAMPLE_RATE or requested with a signed
+# X-Profile-Signature header, writing the profiles to PROFILE_DIR.
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET')
+
+if os.environ.get('PROFILE_SAMPLE_RATE'):
+    PROFILE_SAMPLE_RATE = float(os.environ['PROFILE_SAMPLE_RATE'])
+
+if os.environ.get('PROFILE_MAX_FILES'):
+    PROFILE_MAX_FILES = int(os.environ['PROFILE_MAX_FILES'])
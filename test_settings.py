@@ -1,5 +1,8 @@
 GITHUB_WEBHOOK_SECRET = 'abc'
 GITHUB_ACCESS_TOKEN = '123'
+# Keep the ledger and the pending digests of each test in memory.
+NOTIFICATION_LEDGER_BACKEND = 'memory'
+DIGEST_BACKEND = 'memory'
 
 WATCH_CONFIG = {
     'a/b': {